@@ -0,0 +1,147 @@
+"""
+generates synthetic coral programs of a given size and nesting depth, for benchmarking the front end
+
+    python benchmarks/generate.py 20000 --depth 6 > big.coral
+
+programs come in three shapes:
+functions  many small functions nested up to depth deep
+single     one function whose depth blocks each grow with the program
+nested     one function whose blocks nest deeper the larger the program is
+the last two stress any scanning of blocks which is not linear in their size
+"""
+import argparse
+import random
+
+INDENT = "    "
+# deeper levels are indented like this one, so deeply nested programs do not grow quadratically in characters
+MAX_INDENT = 16
+SHAPES = ("functions", "single", "nested")
+# statements per block of nested programs
+NESTED_BLOCK_LINES = 2
+operators = ("+", "-", "*", "%", "<", ">", "==", "&&", "||")
+
+
+class Generator:
+    def __init__(self, depth=4, seed=0, shape="functions"):
+        """
+        :param depth: deepest nesting of blocks inside a function, unused by nested programs
+        :param seed: seed of the random choices, so the same arguments always give the same program
+        :param shape: one of SHAPES
+        """
+        if shape not in SHAPES:
+            raise ValueError("unknown shape {}".format(shape))
+        self.depth = depth
+        self.shape = shape
+        self.random = random.Random(seed)
+        self.functions = 0
+
+    def program(self, lines):
+        """
+        :param lines: number of lines the program should have, it may have a few more
+        :return: str of coral source code
+        """
+        out = []
+        if self.shape == "single":
+            self.large_function(out, self.depth, max(lines // self.depth, 1))
+            return "\n".join(out) + "\n"
+        elif self.shape == "nested":
+            self.large_function(out, max(lines // (NESTED_BLOCK_LINES + 1), 1), NESTED_BLOCK_LINES)
+            return "\n".join(out) + "\n"
+        while len(out) < lines:
+            if self.random.random() < 0.3:
+                self.statement(out, 0, ["x", "y"])
+            else:
+                self.function(out)
+        return "\n".join(out) + "\n"
+
+    def function(self, out):
+        name = "f{}".format(self.functions)
+        self.functions += 1
+        params = ["a", "b", "c"][:self.random.randint(1, 3)]
+        out.append("func {0} {1} = {{".format(name, " ".join(params)))
+        self.block(out, 1, params, self.random.randint(1, self.depth))
+        out.append("{}return {};".format(INDENT, self.expression(params, 2)))
+        out.append("}")
+
+    def large_function(self, out, depth, per_block):
+        """
+        appends a function of blocks nested depth deep, each holding per_block statements
+        """
+        self.functions += 1
+        names = ["a", "b"]
+        out.append("func f0 a b = {")
+        for level in range(1, depth + 1):
+            for _ in range(per_block):
+                self.statement(out, level, names)
+            if level < depth:
+                out.append("{0}while ({1}) {{".format(indent(level), self.expression(names, 1)))
+        for level in range(depth - 1, 0, -1):
+            out.append("{}}}".format(indent(level)))
+        out.append("{}return a;".format(INDENT))
+        out.append("}")
+
+    def block(self, out, level, names, depth):
+        """
+        appends statements at the given indentation level, with blocks nested depth deep below it
+        """
+        for _ in range(self.random.randint(1, 3)):
+            self.statement(out, level, names)
+        if depth > 1:
+            prefix = indent(level)
+            kind = self.random.choice(("if", "while", "if-else"))
+            keyword = "while" if kind == "while" else "if"
+            out.append("{0}{1} ({2}) {{".format(prefix, keyword, self.expression(names, 1)))
+            self.block(out, level + 1, names, depth - 1)
+            if kind == "if-else":
+                out.append("{0}}} elif ({1}) {{".format(prefix, self.expression(names, 1)))
+                self.block(out, level + 1, names, depth - 1)
+                out.append("{}}} else {{".format(prefix))
+                self.statement(out, level + 1, names)
+            out.append("{}}}".format(prefix))
+
+    def statement(self, out, level, names):
+        prefix = indent(level)
+        choice = self.random.random()
+        if choice < 0.6:
+            out.append("{0}{1} = {2};".format(prefix, self.random.choice(names), self.expression(names, 3)))
+        elif choice < 0.8 and self.functions:
+            out.append("{0}print ({1});".format(prefix, self.call(names)))
+        else:
+            out.append("{0}print {1};".format(prefix, self.random.choice(('"text"', "'more text'", "1.5", "42"))))
+
+    def expression(self, names, depth):
+        if depth == 0 or self.random.random() < 0.3:
+            return self.atom(names)
+        left, right = self.expression(names, depth - 1), self.expression(names, depth - 1)
+        return "({0} {1} {2})".format(left, self.random.choice(operators), right)
+
+    def atom(self, names):
+        if self.random.random() < 0.5:
+            return self.random.choice(names)
+        return str(self.random.randint(0, 1000))
+
+    def call(self, names):
+        func = "f{}".format(self.random.randrange(self.functions))
+        args = " ".join(self.expression(names, 1) for _ in range(self.random.randint(1, 3)))
+        return "{0} {1}".format(func, args)
+
+
+def indent(level):
+    return INDENT * min(level, MAX_INDENT)
+
+
+def generate(lines, depth=4, seed=0, shape="functions"):
+    """
+    :return: str of a coral program of about the given number of lines
+    """
+    return Generator(depth, seed, shape).program(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="generate a synthetic coral program")
+    arg_parser.add_argument("lines", type=int, help="number of lines of the program")
+    arg_parser.add_argument("--depth", type=int, default=4, help="deepest nesting of blocks in a function")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--shape", choices=SHAPES, default="functions")
+    args = arg_parser.parse_args()
+    print(generate(args.lines, args.depth, args.seed, args.shape), end="")
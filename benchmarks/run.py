@@ -0,0 +1,168 @@
+"""
+runs the .coral workloads in this directory, timing lexing, parsing and execution separately
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json
+
+every phase is run --warmup times untimed and then --repeat times timed, and the median of the timed runs
+is what gets compared against a baseline
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+from coral import backends
+from lexer import Lexer
+from parser import Parser
+from stream import Stream
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+PHASES = ("lex", "parse", "exec")
+
+
+def workloads(names=None):
+    """
+    :param names: names of the workloads to run (None for all of them)
+    :return: dict of form {name: source}
+    """
+    paths = sorted(glob.glob(os.path.join(BENCHMARK_DIR, "*.coral")))
+    sources = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if names is None or name in names:
+            with open(path) as f:
+                sources[name] = f.read()
+    if names is not None and set(names) - set(sources):
+        raise ValueError("unknown workloads: {}".format(", ".join(sorted(set(names) - set(sources)))))
+    return sources
+
+
+def time_phases(source, backend):
+    """
+    lexes, parses and runs source once
+    the program's output is discarded, so printing costs as little as possible
+    :return: dict of form {phase: seconds}
+    """
+    start = time.perf_counter()
+    tokens = Lexer(source).buffer()
+    lexed = time.perf_counter()
+    module = Parser(Stream(tokens)).head
+    parsed = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        backends[backend](module)
+    return {"lex": lexed - start, "parse": parsed - lexed, "exec": time.perf_counter() - parsed}
+
+
+def measure(source, backend, warmup, repeat):
+    """
+    :return: dict of form {phase: summary of the timed runs}
+    """
+    for _ in range(warmup):
+        time_phases(source, backend)
+    runs = [time_phases(source, backend) for _ in range(repeat)]
+    return {phase: summarize([run[phase] for run in runs]) for phase in PHASES}
+
+
+def summarize(times):
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "mean": statistics.fmean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "runs": times
+    }
+
+
+def run(names=None, backend="walk", warmup=1, repeat=5, log=sys.stderr):
+    """
+    :return: results, as written to JSON
+    """
+    results = {}
+    for name, source in workloads(names).items():
+        results[name] = measure(source, backend, warmup, repeat)
+        print("{0}: {1}".format(name, "  ".join("{0} {1:.4f}s".format(phase, results[name][phase]["median"])
+                                                for phase in PHASES)), file=log)
+    return {
+        "backend": backend,
+        "warmup": warmup,
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results
+    }
+
+
+def compare(baseline, current, threshold, min_delta=0.001):
+    """
+    compares the median time of every phase of the workloads both runs have
+    :param threshold: fraction by which a phase may be slower than in the baseline before it is a regression
+    :param min_delta: seconds by which a phase must be slower as well, so noise in very short phases is ignored
+    :return: list of rows of form (workload, phase, baseline median, current median, relative change, regressed)
+    """
+    if baseline["backend"] != current["backend"]:
+        raise ValueError("baseline ran the {0} backend, not {1}".format(baseline["backend"], current["backend"]))
+    rows = []
+    for name in sorted(baseline["results"].keys() & current["results"].keys()):
+        for phase in PHASES:
+            before = baseline["results"][name][phase]["median"]
+            after = current["results"][name][phase]["median"]
+            change = after / before - 1 if before else 0.0
+            rows.append((name, phase, before, after, change, change > threshold and after - before > min_delta))
+    return rows
+
+
+def print_comparison(rows, file=sys.stdout):
+    for name, phase, before, after, change, regressed in rows:
+        print("{0:<16} {1:<6} {2:>10.4f}s {3:>10.4f}s {4:>+8.1%}{5}".format(
+            name, phase, before, after, change, "  REGRESSION" if regressed else ""), file=file)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="benchmark the coral interpreter")
+    arg_parser.add_argument("workloads", nargs="*", help="names of the workloads to run (all of them if none)")
+    arg_parser.add_argument("--backend", choices=backends, default="walk")
+    arg_parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the timed ones")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="timed runs of every workload")
+    arg_parser.add_argument("--output", metavar="FILE", help="write the results to FILE as JSON")
+    arg_parser.add_argument("--baseline", metavar="FILE",
+                            help="compare the results against those stored in FILE, failing on regressions")
+    arg_parser.add_argument("--current", metavar="FILE",
+                            help="compare the results stored in FILE instead of running the workloads")
+    arg_parser.add_argument("--threshold", type=float, default=0.1,
+                            help="fraction by which a phase may be slower than its baseline (default 0.1)")
+    arg_parser.add_argument("--min-delta", type=float, default=0.001,
+                            help="seconds by which a phase must also be slower than its baseline (default 0.001)")
+    args = arg_parser.parse_args()
+    if args.repeat < 1:
+        arg_parser.error("--repeat must be at least 1")
+    if args.current is not None:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        try:
+            current = run(args.workloads or None, args.backend, args.warmup, args.repeat)
+        except ValueError as e:
+            arg_parser.error(str(e))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            rows = compare(baseline, current, args.threshold, args.min_delta)
+        except ValueError as e:
+            arg_parser.error(str(e))
+        print_comparison(rows)
+        if any(regressed for *_, regressed in rows):
+            sys.exit(1)
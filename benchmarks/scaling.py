@@ -0,0 +1,113 @@
+"""
+measures how lexing and parsing time and peak memory grow with the size of the program, on programs from
+generate.py, and fails if any of them grows worse than near-linearly
+
+    python benchmarks/scaling.py --sizes 1000 2000 4000 8000 16000 --depth 6
+    python benchmarks/scaling.py --shape nested --sizes 125 250 500 1000
+
+growth is the exponent k of the best fitting curve time = c * size ** k, fitted by least squares on a log-log
+scale, so 1 is linear and 2 quadratic
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+from generate import SHAPES, generate
+from lexer import Lexer
+from parser import Parser
+
+METRICS = ("lex", "parse", "memory")
+
+
+def measure(source, repeat):
+    """
+    :return: dict holding the number of tokens, the best lexing and parsing time out of repeat runs, and the peak
+    memory allocated while lexing and parsing
+    """
+    lex_times, parse_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stream = Lexer(source).tokenize()
+        lexed = time.perf_counter()
+        Parser(stream)
+        lex_times.append(lexed - start)
+        parse_times.append(time.perf_counter() - lexed)
+    # measured apart from the timed runs, which tracing would slow down
+    tracemalloc.start()
+    try:
+        stream = Lexer(source).tokenize()
+        Parser(stream)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"tokens": len(stream.tokens), "lex": min(lex_times), "parse": min(parse_times), "memory": peak}
+
+
+def growth(sizes, values):
+    """
+    :return: slope of the least squares line through the points (log size, log value)
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(value, 1e-9)) for value in values]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+            / sum((x - mean_x) ** 2 for x in xs))
+
+
+def run(sizes, depth=4, repeat=3, seed=0, shape="functions", log=sys.stderr):
+    """
+    :param sizes: numbers of lines of the generated programs
+    :param shape: shape of the generated programs (see generate.py)
+    :return: results, as written to JSON
+    """
+    rows = []
+    for lines in sizes:
+        source = generate(lines, depth, seed, shape)
+        row = {"lines": lines, "chars": len(source), **measure(source, repeat)}
+        rows.append(row)
+        print("{lines:>8} lines {tokens:>9} tokens  lex {lex:.4f}s  parse {parse:.4f}s  peak {0:.1f}MB".format(
+            row["memory"] / 2 ** 20, **row), file=log)
+    # sized by tokens, as the generator only approximates the number of lines
+    tokens = [row["tokens"] for row in rows]
+    return {
+        "depth": depth,
+        "repeat": repeat,
+        "seed": seed,
+        "shape": shape,
+        "sizes": rows,
+        "growth": {metric: growth(tokens, [row[metric] for row in rows]) for metric in METRICS}
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="check that lexing and parsing scale near-linearly")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000, 16000],
+                            help="numbers of lines of the generated programs")
+    arg_parser.add_argument("--depth", type=int, default=4, help="deepest nesting of blocks in a function")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="timed runs per size, the fastest is kept")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--shape", choices=SHAPES, default="functions",
+                            help="shape of the generated programs (see generate.py)")
+    arg_parser.add_argument("--max-growth", type=float, default=1.3,
+                            help="largest exponent of growth allowed (default 1.3)")
+    arg_parser.add_argument("--output", metavar="FILE", help="write the results to FILE as JSON")
+    args = arg_parser.parse_args()
+    if len(set(args.sizes)) < 2:
+        arg_parser.error("at least two distinct sizes are needed to fit a curve")
+    results = run(sorted(set(args.sizes)), args.depth, args.repeat, args.seed, args.shape)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = False
+    for metric, exponent in results["growth"].items():
+        too_steep = exponent > args.max_growth
+        failed |= too_steep
+        print("{0:<7} grows as size ** {1:.2f}{2}".format(metric, exponent, "  SUPERLINEAR" if too_steep else ""))
+    if failed:
+        sys.exit(1)
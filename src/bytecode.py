@@ -0,0 +1,358 @@
+from array import array
+from enum import IntEnum
+from tree import *
+from tokens import binary_operators, operator_symbols
+
+
+class Op(IntEnum):
+    LOAD_CONST = 0
+    LOAD_NAME = 1
+    STORE_NAME = 2
+    BINARY_OP = 3
+    CALL = 4
+    POP_TOP = 5
+    JUMP = 6
+    POP_JUMP_IF_FALSE = 7
+    RETURN_VALUE = 8
+    MAKE_FUNCTION = 9
+    PRINT = 10
+    TAIL_CALL = 11
+    JUMP_IF_FALSE_OR_POP = 12
+    JUMP_IF_TRUE_OR_POP = 13
+    DELETE_NAME = 14
+    # superinstructions, which are never emitted but fused by specialize (see superinstructions)
+    BINARY_CONST = 15
+    BINARY_NAME = 16
+    BINARY_NAME_CONST = 17
+    BINARY_NAME_NAME = 18
+    STORE_BINARY_NAME_CONST = 19
+    STORE_BINARY_NAME_NAME = 20
+    JUMP_UNLESS_NAME_CONST = 21
+    JUMP_UNLESS_NAME_NAME = 22
+    STORE_CONST = 23
+    COPY_NAME = 24
+    JUMP_UNLESS_NAME = 25
+
+
+# plain ints for the vm's dispatch loop, where comparing against enum members is measurably slower
+(LOAD_CONST, LOAD_NAME, STORE_NAME, BINARY_OP, CALL, POP_TOP, JUMP, POP_JUMP_IF_FALSE, RETURN_VALUE,
+ MAKE_FUNCTION, PRINT, TAIL_CALL, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, DELETE_NAME,
+ BINARY_CONST, BINARY_NAME, BINARY_NAME_CONST, BINARY_NAME_NAME, STORE_BINARY_NAME_CONST, STORE_BINARY_NAME_NAME,
+ JUMP_UNLESS_NAME_CONST, JUMP_UNLESS_NAME_NAME, STORE_CONST, COPY_NAME, JUMP_UNLESS_NAME) = map(int, Op)
+jump_ops = {JUMP, POP_JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP}
+
+# sequences of instructions fused into one superinstruction, whose argument is the tuple of their arguments
+# tried in order, so longer sequences come before the ones they start with
+# the fused conditional jumps end with a POP_JUMP_IF_FALSE, and their argument also holds the index of the
+# instruction after the sequence, so that a jump to one can be replaced by a copy of it
+superinstructions = {
+    (LOAD_NAME, LOAD_CONST, BINARY_OP, STORE_NAME): STORE_BINARY_NAME_CONST,
+    (LOAD_NAME, LOAD_NAME, BINARY_OP, STORE_NAME): STORE_BINARY_NAME_NAME,
+    (LOAD_NAME, LOAD_CONST, BINARY_OP, POP_JUMP_IF_FALSE): JUMP_UNLESS_NAME_CONST,
+    (LOAD_NAME, LOAD_NAME, BINARY_OP, POP_JUMP_IF_FALSE): JUMP_UNLESS_NAME_NAME,
+    (LOAD_NAME, LOAD_CONST, BINARY_OP): BINARY_NAME_CONST,
+    (LOAD_NAME, LOAD_NAME, BINARY_OP): BINARY_NAME_NAME,
+    (LOAD_CONST, BINARY_OP): BINARY_CONST,
+    (LOAD_NAME, BINARY_OP): BINARY_NAME,
+    (LOAD_NAME, POP_JUMP_IF_FALSE): JUMP_UNLESS_NAME,
+    (LOAD_CONST, STORE_NAME): STORE_CONST,
+    (LOAD_NAME, STORE_NAME): COPY_NAME
+}
+conditional_jumps = {JUMP_UNLESS_NAME_CONST, JUMP_UNLESS_NAME_NAME, JUMP_UNLESS_NAME}
+
+# BINARY_OP's argument indexes into this table
+operators = tuple(binary_operators.values())
+operator_indices = {func: i for i, func in enumerate(operators)}
+
+
+class CodeObject:
+    __slots__ = ("name", "args", "memo", "code", "constants", "names", "name_indices", "constant_indices",
+                 "instructions")
+
+    def __init__(self, name, args=(), memo=False):
+        """
+        flat bytecode for a single module or function body
+        every instruction takes two entries of self.code: its opcode followed by its argument
+        :param name: name of the function (or module)
+        :param args: names of the function's parameters
+        :param memo: whether functions made from the code cache their results in a MemoFunc
+        """
+        self.name = name
+        self.args = tuple(args)
+        self.memo = memo
+        self.code = array("I")
+        self.constants = []
+        self.names = []
+        self.name_indices = {}
+        self.constant_indices = {}
+        # self.code as run by the vm (see specialize), built when the code first runs
+        self.instructions = None
+
+    def emit(self, op, arg=0):
+        """
+        :return: position of the emitted instruction in self.code
+        """
+        self.code.append(op)
+        self.code.append(arg)
+        return len(self.code) - 2
+
+    def patch(self, position, target):
+        """
+        points an already emitted jump at target
+        """
+        self.code[position + 1] = target
+
+    def patch_op(self, position, op):
+        """
+        replaces the opcode of an already emitted instruction
+        """
+        self.code[position] = op
+
+    def position(self):
+        return len(self.code)
+
+    def constant(self, value):
+        """
+        :return: index of value in the constant pool, adding it if needed
+        """
+        try:
+            # type is part of the key so that e.g. 1, 1.0 and true stay distinct
+            key = (type(value), value)
+            if key not in self.constant_indices:
+                self.constant_indices[key] = len(self.constants)
+                self.constants.append(value)
+            return self.constant_indices[key]
+        except TypeError:
+            self.constants.append(value)
+            return len(self.constants) - 1
+
+    def name_index(self, name):
+        if name not in self.name_indices:
+            self.name_indices[name] = len(self.names)
+            self.names.append(name)
+        return self.name_indices[name]
+
+    def __str__(self):
+        return disassemble(self)
+
+
+class BytecodeCompiler:
+    """
+    compiles AST nodes into CodeObjects run by vm.VM
+    """
+    def __init__(self):
+        self.code = None
+        self.module_code = None
+
+    def compile_module(self, module):
+        """
+        :param module: Module object to compile
+        :return: function of form f(namespace) which runs the module on a fresh vm
+        """
+        from vm import VM
+        code = self.compile(module)
+
+        def run(namespace):
+            VM().execute(code, namespace)
+        return run
+
+    def compile(self, module):
+        """
+        :return: CodeObject for the module's top level
+        """
+        self.code = self.module_code = CodeObject(module.name)
+        self.compile_block(module.nodes)
+        self.code.emit(LOAD_CONST, self.code.constant(None))
+        self.code.emit(RETURN_VALUE)
+        return self.code
+
+    def compile_statement(self, node):
+        if isinstance(node, Expression):
+            self.compile_node(node)
+            self.code.emit(POP_TOP)
+        elif isinstance(node, Statement):
+            self.compile_node(node)
+        else:
+            raise TypeError
+
+    def compile_block(self, statements):
+        for statement in statements:
+            self.compile_statement(statement)
+
+    def compile_node(self, node):
+        handler = self.handlers.get(type(node))
+        if handler is None:
+            raise TypeError("cannot compile {} to bytecode".format(type(node).__name__))
+        handler(self, node)
+
+    def compile_assignment(self, node):
+        self.compile_node(node.value)
+        self.code.emit(STORE_NAME, self.code.name_index(node.name))
+
+    def compile_func_def(self, node):
+        outer, self.code = self.code, CodeObject(node.name, node.args or (), bool(node.memo))
+        self.compile_block(node.statements)
+        self.code.emit(LOAD_CONST, self.code.constant(None))
+        self.code.emit(RETURN_VALUE)
+        func_code, self.code = self.code, outer
+        self.code.emit(MAKE_FUNCTION, self.code.constant(func_code))
+        self.code.emit(STORE_NAME, self.code.name_index(node.name))
+
+    def compile_output(self, node):
+        self.compile_node(node.expression)
+        self.code.emit(PRINT)
+
+    def compile_return(self, node):
+        if self.code is self.module_code:
+            raise SyntaxError("'return' outside function")
+        self.compile_node(node.expr)
+        if isinstance(node.expr, Call):
+            # nothing is left to run in the caller, so the vm can run the callee in its frame
+            self.code.patch_op(len(self.code.code) - 2, TAIL_CALL)
+        self.code.emit(RETURN_VALUE)
+
+    def compile_conditional(self, node):
+        end_jumps = []
+        while node is not None:
+            self.compile_node(node.condition)
+            skip = self.code.emit(POP_JUMP_IF_FALSE)
+            self.compile_block(node.statements)
+            if node.next_node is not None:
+                end_jumps.append(self.code.emit(JUMP))
+            self.code.patch(skip, self.code.position())
+            node = node.next_node
+        for jump in end_jumps:
+            self.code.patch(jump, self.code.position())
+
+    def compile_while(self, node):
+        start = self.code.position()
+        self.compile_node(node.condition)
+        exit_jump = self.code.emit(POP_JUMP_IF_FALSE)
+        self.compile_block(node.statements)
+        self.code.emit(JUMP, start)
+        self.code.patch(exit_jump, self.code.position())
+
+    def compile_unbind(self, node):
+        for name in node.names:
+            self.code.emit(DELETE_NAME, self.code.name_index(name))
+
+    def compile_call(self, node):
+        self.code.emit(LOAD_NAME, self.code.name_index(node.func_name))
+        for arg in node.arg_vals:
+            self.compile_node(arg)
+        self.code.emit(CALL, len(node.arg_vals))
+
+    def compile_object_lookup(self, node):
+        self.code.emit(LOAD_NAME, self.code.name_index(node.name))
+
+    def compile_value(self, node):
+        self.code.emit(LOAD_CONST, self.code.constant(node.value))
+
+    def compile_binary_operator(self, node):
+        self.compile_node(node.left)
+        self.compile_node(node.right)
+        self.code.emit(BINARY_OP, operator_indices[node.func])
+
+    def compile_logical_operator(self, node):
+        # the left operand is left as the result if it decides it, else it is popped for the right one
+        self.compile_node(node.left)
+        jump = self.code.emit(JUMP_IF_FALSE_OR_POP if isinstance(node, LogicalAnd) else JUMP_IF_TRUE_OR_POP)
+        self.compile_node(node.right)
+        self.code.patch(jump, self.code.position())
+
+    handlers = {
+        Assignment: compile_assignment,
+        FuncDef: compile_func_def,
+        Output: compile_output,
+        Return: compile_return,
+        Conditional: compile_conditional,
+        While: compile_while,
+        Unbind: compile_unbind,
+        Call: compile_call,
+        ObjectLookup: compile_object_lookup,
+        Value: compile_value,
+        BinaryOperator: compile_binary_operator,
+        LogicalAnd: compile_logical_operator,
+        LogicalOr: compile_logical_operator
+    }
+
+
+def specialize(code, fuse=True):
+    """
+    decodes a CodeObject into the form the vm runs
+    every instruction becomes one (opcode, argument) tuple, whose argument is what the instruction uses
+    rather than an index of it: the constant, name or operator function, or the index of the instruction
+    a jump goes to
+    the sequences of instructions in superinstructions are fused, the superinstruction taking the place of
+    the first instruction of the sequence and skipping the rest; the fused instructions are kept behind it, so jumps into
+    the middle of a sequence still run them
+    :param fuse: whether to fuse superinstructions
+    :return: list of (opcode, argument) tuples
+    """
+    instructions = []
+    for position in range(0, len(code.code), 2):
+        op, arg = code.code[position], code.code[position + 1]
+        if op == LOAD_CONST or op == MAKE_FUNCTION:
+            arg = code.constants[arg]
+        elif op == LOAD_NAME or op == STORE_NAME or op == DELETE_NAME:
+            arg = code.names[arg]
+        elif op == BINARY_OP:
+            arg = operators[arg]
+        elif op in jump_ops:
+            arg //= 2
+        instructions.append((op, arg))
+    if not fuse:
+        return instructions
+    ops = tuple(op for op, _ in instructions)
+    fused = list(instructions)
+    for i in range(len(instructions)):
+        for sequence, superinstruction in superinstructions.items():
+            if ops[i:i + len(sequence)] == sequence:
+                args = tuple(arg for _, arg in instructions[i:i + len(sequence)])
+                if superinstruction in conditional_jumps:
+                    args += (i + len(sequence),)
+                fused[i] = (superinstruction, args)
+                break
+    # a loop jumps back to its condition on every iteration, which is tested right away instead
+    for i, (op, arg) in enumerate(fused):
+        if op == JUMP and fused[arg][0] in conditional_jumps:
+            fused[i] = fused[arg]
+    return fused
+
+
+def disassemble(code):
+    """
+    renders a CodeObject and every function nested inside it as human readable text
+    :param code: CodeObject to disassemble
+    :return: disassembly listing
+    """
+    lines = ["code object {0}({1}): {2} instructions, {3} constants, {4} names{5}".format(
+        code.name, ", ".join(code.args), len(code.code) // 2, len(code.constants), len(code.names),
+        ", memoized" if code.memo else ""
+    )]
+    nested = []
+    for position in range(0, len(code.code), 2):
+        op, arg = code.code[position], code.code[position + 1]
+        if op == LOAD_CONST or op == MAKE_FUNCTION:
+            const = code.constants[arg]
+            if isinstance(const, CodeObject):
+                nested.append(const)
+                detail = "<code object {}>".format(const.name)
+            else:
+                detail = repr(const)
+        elif op == LOAD_NAME or op == STORE_NAME or op == DELETE_NAME:
+            detail = code.names[arg]
+        elif op == BINARY_OP:
+            detail = operator_symbols[operators[arg]]
+        elif op in jump_ops:
+            detail = "to {}".format(arg)
+        elif op == CALL or op == TAIL_CALL:
+            detail = "{} args".format(arg)
+        else:
+            lines.append("{0:>6} {1}".format(position, Op(op).name))
+            continue
+        lines.append("{0:>6} {1:<18} {2:>4} ({3})".format(position, Op(op).name, arg, detail))
+    for const in nested:
+        lines.append("")
+        lines.append(disassemble(const))
+    return "\n".join(lines)
@@ -0,0 +1,308 @@
+import hashlib
+import os
+import struct
+import tempfile
+from tree import *
+from array import array
+from tokens import Positions, binary_operators, operator_symbols
+
+CACHE_DIR = "__coralcache__"
+MAGIC = b"\xc0RL\n"
+# bump whenever the encoding or the trees produced by the parser change, so older caches are ignored
+FORMAT_VERSION = 6
+# magic, format version, digest of the source and digest of the payload following the header
+header = struct.Struct("<4sH32s32s")
+float_struct = struct.Struct("<d")
+
+# a node is written as its tag, 0 standing for None
+node_types = (None, *node_fields)
+node_tags = {node_type: tag for tag, node_type in enumerate(node_types)}
+# tags of constants, which are written as one byte followed by their payload
+NONE, FALSE, TRUE, INT, FLOAT, STR = range(6)
+
+
+def source_digest(file):
+    """
+    :param file: binary file object, read to the end
+    :return: sha256 digest of its contents
+    """
+    return hashlib.file_digest(file, "sha256").digest()
+
+
+def cache_path(source_path):
+    directory, name = os.path.split(source_path)
+    return os.path.join(directory, CACHE_DIR, "{0}.v{1}.bin".format(name, FORMAT_VERSION))
+
+
+def load(source_path, digest):
+    """
+    :param source_path: path of the source file
+    :param digest: source_digest of its current contents
+    :return: the cached Module, or None if there is no valid cache for this version of the source
+    """
+    try:
+        with open(cache_path(source_path), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        return Decoder(data).module(digest)
+    except (ValueError, IndexError, KeyError, struct.error, UnicodeDecodeError, RecursionError):
+        # corrupt or written for a different source, the caller parses instead
+        return None
+
+
+def store(source_path, digest, module):
+    """
+    writes module to the cache of source_path
+    the file is written under a temporary name and moved into place, so concurrent readers and writers
+    only ever see complete cache files
+    failing to write the cache is not an error, it is only an optimization
+    """
+    path = cache_path(source_path)
+    try:
+        data = Encoder().module(module, digest)
+    except TypeError:
+        # e.g. a function whose parameters are not all identifiers, which is left to fail at runtime
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".tmp", delete=False) as f:
+            f.write(data)
+        try:
+            # temporary files are private, the cache is as readable as its source
+            os.chmod(f.name, os.stat(source_path).st_mode & 0o666)
+            os.replace(f.name, path)
+        except OSError:
+            os.unlink(f.name)
+            raise
+    except OSError:
+        pass
+
+
+class Encoder:
+    def __init__(self):
+        """
+        serializes a Module as a header, a table of every distinct string, and the tree in preorder
+        names and string constants are written as indices into the table
+        the positions of the module's tokens are written after the tree, as differences from the previous one
+        the header holds a digest of the rest of the file, so a payload corrupted into something which still
+        decodes is not loaded
+        """
+        self.body = bytearray()
+        self.strings = []
+        self.string_indices = {}
+
+    def module(self, module, digest):
+        """
+        :return: bytes of the cache file
+        """
+        self.string(module.name)
+        self.nodes(module.nodes)
+        self.positions(module.positions)
+        body, self.body = self.body, bytearray()
+        self.uint(len(self.strings))
+        for s in self.strings:
+            encoded = s.encode()
+            self.uint(len(encoded))
+            self.body += encoded
+        payload = self.body + body
+        return header.pack(MAGIC, FORMAT_VERSION, digest, hashlib.sha256(payload).digest()) + payload
+
+    def uint(self, n):
+        while n >= 0x80:
+            self.body.append(n & 0x7f | 0x80)
+            n >>= 7
+        self.body.append(n)
+
+    def positions(self, positions):
+        # None is written as 0, so counts are offset by one
+        if positions is None:
+            self.uint(0)
+            return
+        for table in (positions.offsets, positions.line_starts):
+            self.uint(len(table) + 1)
+            previous = 0
+            for position in table:
+                self.uint(position - previous)
+                previous = position
+
+    def string(self, s):
+        if not isinstance(s, str):
+            raise TypeError("cannot cache name of type {}".format(type(s).__name__))
+        if s not in self.string_indices:
+            self.string_indices[s] = len(self.strings)
+            self.strings.append(s)
+        self.uint(self.string_indices[s])
+
+    def names(self, names):
+        # None is written as 0, so counts are offset by one
+        if names is None:
+            self.uint(0)
+        else:
+            self.uint(len(names) + 1)
+            for name in names:
+                self.string(name)
+
+    def node(self, node):
+        if node is not None and type(node) not in node_fields:
+            raise TypeError("cannot cache {} nodes".format(type(node).__name__))
+        self.uint(node_tags[None if node is None else type(node)])
+        if node is not None:
+            # 0 for nodes without a line or span, the span is written as its start and length
+            self.uint(node.line or 0)
+            if node.start is None:
+                self.uint(0)
+            else:
+                self.uint(node.start + 1)
+                self.uint(node.end - node.start)
+        for attr, kind in node_fields.get(type(node), ()):
+            self.encoders[kind](self, getattr(node, attr))
+
+    def nodes(self, nodes):
+        self.uint(len(nodes))
+        for node in nodes:
+            self.node(node)
+
+    def operator(self, func):
+        self.string(operator_symbols[func])
+
+    def constant(self, value):
+        if value is None or isinstance(value, bool):
+            self.body.append({None: NONE, False: FALSE, True: TRUE}[value])
+        elif isinstance(value, int):
+            self.body.append(INT)
+            # zigzag encoding keeps small negative numbers short
+            self.uint(value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            self.body.append(FLOAT)
+            self.body += float_struct.pack(value)
+        elif isinstance(value, str):
+            self.body.append(STR)
+            self.string(value)
+        else:
+            raise TypeError("cannot cache constant of type {}".format(type(value).__name__))
+
+    encoders = {
+        "name": string,
+        "names": names,
+        "node": node,
+        "nodes": nodes,
+        "operator": operator,
+        "constant": constant
+    }
+
+
+class Decoder:
+    def __init__(self, data):
+        """
+        reads a cache file written by Encoder
+        :param data: bytes of the file
+        """
+        self.data = data
+        self.pos = 0
+        self.strings = []
+
+    def module(self, digest):
+        """
+        :param digest: digest the file must have been written for
+        :return: Module object
+        """
+        magic, version, file_digest, payload_digest = header.unpack_from(self.data)
+        if magic != MAGIC or version != FORMAT_VERSION or file_digest != digest:
+            raise ValueError("stale cache")
+        if hashlib.sha256(memoryview(self.data)[header.size:]).digest() != payload_digest:
+            raise ValueError("corrupt cache")
+        self.pos = header.size
+        for _ in range(self.uint()):
+            size = self.uint()
+            if self.pos + size > len(self.data):
+                raise ValueError("truncated cache")
+            self.strings.append(self.data[self.pos:self.pos + size].decode())
+            self.pos += size
+        name = self.string()
+        nodes = self.nodes()
+        positions = self.positions()
+        if self.pos != len(self.data):
+            raise ValueError("trailing data in cache")
+        return Module(nodes, name, positions)
+
+    def uint(self):
+        n = shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def byte(self):
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    def positions(self):
+        tables = []
+        for _ in range(2):
+            count = self.uint()
+            if not count:
+                return None
+            table = array("Q")
+            position = 0
+            for _ in range(count - 1):
+                position += self.uint()
+                table.append(position)
+            tables.append(table)
+        return Positions(*tables)
+
+    def string(self):
+        return self.strings[self.uint()]
+
+    def names(self):
+        count = self.uint()
+        if not count:
+            return None
+        return tuple(self.string() for _ in range(count - 1))
+
+    def node(self):
+        node_type = node_types[self.uint()]
+        if node_type is None:
+            return None
+        line = self.uint()
+        start = self.uint()
+        if start:
+            end = start - 1 + self.uint()
+        node = node_type(*(self.decoders[kind](self) for _, kind in node_fields[node_type]))
+        if line:
+            node.line = line
+        if start:
+            node.start, node.end = start - 1, end
+        return node
+
+    def nodes(self):
+        return [self.node() for _ in range(self.uint())]
+
+    def operator(self):
+        return binary_operators[self.string()]
+
+    def constant(self):
+        tag = self.byte()
+        if tag == INT:
+            n = self.uint()
+            return -(n + 1 >> 1) if n & 1 else n >> 1
+        elif tag == FLOAT:
+            value, = float_struct.unpack_from(self.data, self.pos)
+            self.pos += float_struct.size
+            return value
+        elif tag == STR:
+            return self.string()
+        return (None, False, True)[tag]
+
+    decoders = {
+        "name": string,
+        "names": names,
+        "node": node,
+        "nodes": nodes,
+        "operator": operator,
+        "constant": constant
+    }
@@ -0,0 +1,244 @@
+from tree import *
+from object import CompiledFunc, MemoFunc
+
+
+def fetcher(name):
+    """
+    builds a closure performing the same lookup as Namespace.fetch without recursive method calls
+    :param name: name to look up
+    :return: function of form f(namespace) -> value
+    """
+    def fetch(namespace):
+        obj_dict = namespace.obj_dict
+        if name in obj_dict:
+            return obj_dict[name]
+        namespace = namespace.parent
+        while namespace is not None:
+            obj_dict = namespace.obj_dict
+            if name in obj_dict:
+                return obj_dict[name]
+            namespace = namespace.parent
+        raise LookupError
+    return fetch
+
+
+class ClosureCompiler:
+    """
+    compiles AST nodes into nested python closures, with the children of every node bound ahead of time
+    statement closures return None to continue execution, or a 1-tuple holding the returned value
+    expression closures return the value of the expression
+    """
+    def __init__(self):
+        self.in_function = False
+
+    def compile_module(self, module):
+        """
+        :param module: Module object to compile
+        :return: function of form f(namespace) which runs the module
+        """
+        statements = tuple(self.compile_statement(node) for node in module.nodes)
+
+        def run(namespace):
+            for statement in statements:
+                statement(namespace)
+        return run
+
+    def compile_statement(self, node):
+        if isinstance(node, Expression):
+            expression = self.compile(node)
+
+            def run(namespace):
+                expression(namespace)
+            return run
+        elif isinstance(node, Statement):
+            return self.compile(node)
+        else:
+            raise TypeError
+
+    def compile_block(self, statements):
+        """
+        :param statements: list of Statement nodes
+        :return: closure running every statement in order, stopping at the first return
+        """
+        statements = tuple(self.compile_statement(statement) for statement in statements)
+        if len(statements) == 1:
+            return statements[0]
+
+        def run(namespace):
+            for statement in statements:
+                ret = statement(namespace)
+                if ret is not None:
+                    return ret
+        return run
+
+    def compile(self, node):
+        handler = self.handlers.get(type(node))
+        if handler is not None:
+            return handler(self, node)
+        # unknown nodes fall back to tree walking
+        elif isinstance(node, Expression):
+            return node.eval
+        else:
+            return node.exec
+
+    def compile_assignment(self, node):
+        name = node.name
+        value = self.compile(node.value)
+
+        def run(namespace):
+            namespace.obj_dict[name] = value(namespace)
+        return run
+
+    def compile_func_def(self, node):
+        name, args, statements = node.name, node.args, node.statements
+        in_function, self.in_function = self.in_function, True
+        body = self.compile_block(statements)
+        self.in_function = in_function
+
+        if node.memo:
+            def run(namespace):
+                namespace.obj_dict[name] = MemoFunc(CompiledFunc(scope=namespace, name=name, args=args,
+                                                                 statements=statements, body=body))
+            return run
+
+        def run(namespace):
+            namespace.obj_dict[name] = CompiledFunc(scope=namespace, name=name, args=args,
+                                                    statements=statements, body=body)
+        return run
+
+    def compile_output(self, node):
+        expression = self.compile(node.expression)
+
+        def run(namespace):
+            print(expression(namespace))
+        return run
+
+    def compile_return(self, node):
+        # a return outside of a function is left to raise like it does when tree walking
+        if not self.in_function:
+            return node.exec
+        expr = self.compile(node.expr)
+
+        def run(namespace):
+            return expr(namespace),
+        return run
+
+    def compile_conditional(self, node):
+        condition = self.compile(node.condition)
+        body = self.compile_block(node.statements)
+        if node.next_node is None:
+            def run(namespace):
+                if condition(namespace):
+                    return body(namespace)
+        else:
+            next_node = self.compile(node.next_node)
+
+            def run(namespace):
+                if condition(namespace):
+                    return body(namespace)
+                return next_node(namespace)
+        return run
+
+    def compile_while(self, node):
+        condition = self.compile(node.condition)
+        body = self.compile_block(node.statements)
+
+        def run(namespace):
+            while condition(namespace):
+                ret = body(namespace)
+                if ret is not None:
+                    return ret
+        return run
+
+    def compile_call(self, node):
+        fetch = fetcher(node.func_name)
+        args = tuple(self.compile(arg) for arg in node.arg_vals)
+        # specialize the common arities to avoid building an intermediate list
+        if not args:
+            def call(namespace):
+                return fetch(namespace)()
+        elif len(args) == 1:
+            arg, = args
+
+            def call(namespace):
+                return fetch(namespace)(arg(namespace))
+        elif len(args) == 2:
+            first, second = args
+
+            def call(namespace):
+                return fetch(namespace)(first(namespace), second(namespace))
+        else:
+            def call(namespace):
+                return fetch(namespace)(*[arg(namespace) for arg in args])
+        return call
+
+    def compile_object_lookup(self, node):
+        return fetcher(node.name)
+
+    def compile_value(self, node):
+        value = node.value
+
+        def constant(namespace):
+            return value
+        return constant
+
+    def compile_binary_operator(self, node):
+        func = node.func
+        left, right = node.left, node.right
+        # operands which are plain names or constants are read inline, saving a closure call each
+        if isinstance(left, ObjectLookup) and isinstance(right, Value):
+            name, fetch, right = left.name, fetcher(left.name), right.value
+
+            def binary(namespace):
+                obj_dict = namespace.obj_dict
+                return func(obj_dict[name] if name in obj_dict else fetch(namespace), right)
+        elif isinstance(left, ObjectLookup) and isinstance(right, ObjectLookup):
+            left_name, left_fetch = left.name, fetcher(left.name)
+            right_name, right_fetch = right.name, fetcher(right.name)
+
+            def binary(namespace):
+                obj_dict = namespace.obj_dict
+                return func(
+                    obj_dict[left_name] if left_name in obj_dict else left_fetch(namespace),
+                    obj_dict[right_name] if right_name in obj_dict else right_fetch(namespace)
+                )
+        elif isinstance(right, Value):
+            left, right = self.compile(left), right.value
+
+            def binary(namespace):
+                return func(left(namespace), right)
+        else:
+            left, right = self.compile(left), self.compile(right)
+
+            def binary(namespace):
+                return func(left(namespace), right(namespace))
+        return binary
+
+    def compile_logical_and(self, node):
+        left, right = self.compile(node.left), self.compile(node.right)
+
+        def logical_and(namespace):
+            return left(namespace) and right(namespace)
+        return logical_and
+
+    def compile_logical_or(self, node):
+        left, right = self.compile(node.left), self.compile(node.right)
+
+        def logical_or(namespace):
+            return left(namespace) or right(namespace)
+        return logical_or
+
+    handlers = {
+        Assignment: compile_assignment,
+        FuncDef: compile_func_def,
+        Output: compile_output,
+        Return: compile_return,
+        Conditional: compile_conditional,
+        While: compile_while,
+        Call: compile_call,
+        ObjectLookup: compile_object_lookup,
+        Value: compile_value,
+        BinaryOperator: compile_binary_operator,
+        LogicalAnd: compile_logical_and,
+        LogicalOr: compile_logical_or
+    }
@@ -1,14 +1,250 @@
+import argparse
+import sys
+import time
+import cache
 from lexer import Lexer
 from parser import Parser
+from tree import Module
+from object import FuncProfile, MemoFunc
 
+backends = {
+    "walk": Module.walk,
+    "closure": Module.run_compiled,
+    "python": Module.run_python,
+    "resolved": Module.run_resolved,
+    "bytecode": Module.run_bytecode
+}
 
-def run(file="test.coral"):
-    with open(file) as f:
-        source = f.read()
-    lexer = Lexer(source)
-    parser = Parser(lexer.tokenize())
-    parser.head.walk()
+
+def parse(file, use_cache=True, metrics=None):
+    """
+    :param use_cache: whether to load the module from (and save it to) the parse cache next to file
+    :param metrics: metrics.Metrics object receiving the number of tokens and the time spent lexing and parsing
+    (None to not measure them)
+    :return: Module object
+    """
+    start = time.perf_counter()
+    with open(file, "rb") as f:
+        if use_cache:
+            digest = cache.source_digest(f)
+            module = cache.load(file, digest)
+            if module is not None:
+                if metrics is not None:
+                    metrics.cache_hit = True
+                    metrics.parse_time = time.perf_counter() - start
+                return module
+            f.seek(0)
+        # the lexer streams the file in chunks rather than holding all of it in memory
+        lexer = Lexer(f)
+        if metrics is None:
+            module = Parser(lexer.tokenize()).head
+        else:
+            stream = lexer.tokenize()
+            lexed = time.perf_counter()
+            module = Parser(stream).head
+            metrics.tokens = len(stream.tokens)
+            metrics.lex_time = lexed - start
+            metrics.parse_time = time.perf_counter() - lexed
+    if use_cache:
+        cache.store(file, digest, module)
+    return module
+
+
+def load(file, use_cache=True, optimize=False, dump_passes=False, metrics=None):
+    """
+    :param optimize: whether to run the module through optimizer.Optimizer
+    :param dump_passes: whether to print the tree before and after every optimization pass to stderr
+    :return: Module object
+    """
+    module = parse(file, use_cache, metrics)
+    if optimize:
+        from optimizer import Optimizer
+        start = time.perf_counter()
+        module = Optimizer(dump=sys.stderr if dump_passes else None).optimize(module)
+        if metrics is not None:
+            metrics.optimize_time = time.perf_counter() - start
+    return module
+
+
+def run(file="test.coral", backend="walk", use_cache=True, optimize=False, dump_passes=False, metrics=None):
+    """
+    :param metrics: metrics.Metrics object filled in with measurements of every phase of the run (None to not
+    measure anything), whose emit method writes them to a file
+    :return: the Module object after running
+    """
+    module = load(file, use_cache, optimize, dump_passes, metrics)
+    if metrics is None:
+        execute(module, backends[backend])
+        return module
+    metrics.count_nodes(module)
+    start = time.perf_counter()
+    # python functions do not create namespaces, so there is nothing to count on the python backend
+    if backend == "python":
+        execute(module, backends[backend])
+    else:
+        execute(module, metrics.run_instrumented, backends[backend])
+    metrics.exec_time = time.perf_counter() - start
+    return module
+
+
+def execute(module, runner, *args):
+    """
+    calls runner(module, *args), printing the line and column of the node which raised to stderr if the program
+    raises
+    """
+    try:
+        runner(module, *args)
+    except Exception as error:
+        position = module.error_position(error)
+        if position is not None:
+            print("error at {0}:{1}".format(*position), file=sys.stderr)
+        raise
+
+
+def profile(file="test.coral", backend="walk", use_cache=True, optimize=False, sample=False, interval=0.005,
+            stacks=None):
+    """
+    runs file under a profiler, printing its report to stderr
+    :param sample: whether to use profiler.SamplingProfiler instead of the deterministic profiler.Profiler,
+    which only profiles the walk backend
+    :param interval: seconds between samples
+    :param stacks: path of the file the collapsed stacks are written to (None to not write them)
+    :return: the Module object after running
+    """
+    import profiler
+    module = load(file, use_cache, optimize)
+    if sample:
+        prof = profiler.SamplingProfiler(interval)
+        execute(module, prof.run, backends[backend])
+    else:
+        prof = profiler.Profiler()
+        execute(module, prof.run)
+    prof.report()
+    if stacks is not None:
+        with open(stacks, "w") as f:
+            prof.write_stacks(f)
+    return module
+
+
+def memprofile(file="test.coral", use_cache=True, optimize=False, interval=None, output=None):
+    """
+    walks file under profiler.MemoryProfiler, printing its report to stderr
+    :param interval: number of statements run between snapshots (None for a snapshot at exit only)
+    :param output: path of the file snapshots are written to (None to not write any)
+    :return: the Module object after running
+    """
+    import profiler
+    module = load(file, use_cache, optimize)
+    f = None if output is None else open(output, "w")
+    try:
+        prof = profiler.MemoryProfiler(interval, f)
+        execute(module, prof.run)
+    finally:
+        if f is not None:
+            f.close()
+    prof.report()
+    return module
+
+
+def memo_stats(module):
+    """
+    prints the cache statistics of every memoized function bound in the module's namespace to stderr
+    """
+    for name, value in module.namespace.obj_dict.items():
+        if isinstance(value, MemoFunc):
+            print("{0}: {1} hits, {2} misses, {3}/{4} cached".format(
+                name, value.hits, value.misses, len(value.cache), value.size), file=sys.stderr)
+
+
+def disassemble(file="test.coral", optimize=False):
+    from bytecode import BytecodeCompiler
+    print(BytecodeCompiler().compile(load(file, optimize=optimize)))
 
 
 if __name__ == "__main__":
-    run()
+    arg_parser = argparse.ArgumentParser(description="run a coral program")
+    arg_parser.add_argument("file", nargs="?", default="test.coral")
+    arg_parser.add_argument("--backend", choices=backends, default="walk",
+                            help="how the parsed module is executed")
+    arg_parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                            help="always parse the source instead of using the parse cache")
+    arg_parser.add_argument("-O", "--optimize", action="store_true",
+                            help="fold constants, remove dead branches and hoist loop invariants before running")
+    arg_parser.add_argument("--dump-passes", action="store_true",
+                            help="print the tree before and after every optimization pass to stderr")
+    arg_parser.add_argument("--memo-size", type=int, default=MemoFunc.size,
+                            help="number of results cached per memoized function")
+    arg_parser.add_argument("--memo-stats", action="store_true",
+                            help="print cache hits and misses of memoized functions to stderr after running")
+    arg_parser.add_argument("--jit-calls", type=int, default=FuncProfile.call_threshold,
+                            help="calls after which the walk backend compiles a function")
+    arg_parser.add_argument("--jit-loops", type=int, default=FuncProfile.loop_threshold,
+                            help="loop iterations after which the walk backend compiles a function")
+    arg_parser.add_argument("--no-jit", action="store_true",
+                            help="always tree walk functions in the walk backend")
+    arg_parser.add_argument("--jit-report", action="store_true",
+                            help="print the functions compiled by the walk backend to stderr after running")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="time every function and source line, printing the results to stderr "
+                                 "(walk backend only)")
+    arg_parser.add_argument("--profile-sample", action="store_true",
+                            help="profile by sampling the running stack, which is cheap enough to leave on "
+                                 "(walk, closure and resolved backends)")
+    arg_parser.add_argument("--profile-interval", type=float, default=5,
+                            help="milliseconds between samples of --profile-sample")
+    arg_parser.add_argument("--profile-stacks", metavar="FILE",
+                            help="write the profiled stacks to FILE in the collapsed format of flame graph tools")
+    arg_parser.add_argument("--memprofile", action="store_true",
+                            help="attribute the memory retained to every function and source line, and count "
+                                 "live namespaces, printing the results to stderr (walk backend only)")
+    arg_parser.add_argument("--memprofile-output", metavar="FILE",
+                            help="write snapshots of --memprofile to FILE in a format suited to diff")
+    arg_parser.add_argument("--memprofile-interval", type=int, metavar="N",
+                            help="also write a snapshot every N statements, not only at exit")
+    arg_parser.add_argument("--timings", action="store_true",
+                            help="print the size of the program and the time spent in every phase to stderr")
+    arg_parser.add_argument("--metrics-file", metavar="FILE",
+                            help="write the measurements of --timings to FILE, without printing them")
+    arg_parser.add_argument("--metrics-format", choices=("json", "prometheus"), default="json",
+                            help="append a line of JSON to --metrics-file, or replace it with Prometheus text")
+    arg_parser.add_argument("--disassemble", action="store_true",
+                            help="print the module's bytecode instead of running it")
+    args = arg_parser.parse_args()
+    if args.profile and args.backend != "walk":
+        arg_parser.error("--profile only profiles the walk backend, use --profile-sample for others")
+    if args.profile_sample and args.backend in ("python", "bytecode"):
+        arg_parser.error("--profile-sample only profiles the walk, closure and resolved backends")
+    if args.memprofile and args.backend != "walk":
+        arg_parser.error("--memprofile only profiles the walk backend")
+    if args.memprofile_interval is not None and args.memprofile_interval < 1:
+        arg_parser.error("--memprofile-interval must be at least 1")
+    MemoFunc.size = args.memo_size
+    if args.no_jit:
+        FuncProfile.call_threshold = FuncProfile.loop_threshold = None
+    else:
+        FuncProfile.call_threshold, FuncProfile.loop_threshold = args.jit_calls, args.jit_loops
+    if args.disassemble:
+        disassemble(args.file, args.optimize)
+    else:
+        start = time.perf_counter()
+        if args.profile or args.profile_sample:
+            module = profile(args.file, args.backend, args.use_cache, args.optimize, args.profile_sample,
+                             args.profile_interval / 1000, args.profile_stacks)
+        elif args.memprofile:
+            module = memprofile(args.file, args.use_cache, args.optimize, args.memprofile_interval,
+                                args.memprofile_output)
+        else:
+            metrics = None
+            if args.timings or args.metrics_file is not None:
+                from metrics import Metrics
+                metrics = Metrics(args.file, args.backend)
+            module = run(args.file, args.backend, args.use_cache, args.optimize, args.dump_passes, metrics)
+            if args.timings:
+                metrics.report()
+            if args.metrics_file is not None:
+                metrics.emit(args.metrics_file, args.metrics_format)
+        if args.memo_stats:
+            memo_stats(module)
+        if args.jit_report:
+            import jit
+            jit.report(start)
@@ -0,0 +1,260 @@
+from bisect import bisect_left, bisect_right
+from lexer import Lexer
+from optimizer import walk
+from parser import Parser
+from stream import Stream
+from tree import Module
+
+
+class SourcePositions:
+    def __init__(self, parser):
+        """
+        tokens.Positions of the tokens of an IncrementalParser's source, which its module's nodes index, lexed
+        when a position is first asked for rather than on every edit
+        :param parser: the IncrementalParser
+        """
+        self.parser = parser
+        self.positions = None
+
+    def table(self):
+        if self.positions is None:
+            self.positions = Lexer(self.parser.source).buffer().positions()
+        return self.positions
+
+    def position(self, i):
+        return self.table().position(i)
+
+    def location(self, i):
+        return self.table().location(i)
+
+    def __len__(self):
+        return len(self.table())
+
+
+class IncrementalParser:
+    def __init__(self, source="", module_name="main"):
+        """
+        parser for source code which is edited repeatedly, e.g. by an editor or a hot-reload loop
+        the source is kept as one piece of text per top-level rule, so an edit only relexes and reparses the
+        rules it touches, and every other rule keeps its Statement object
+        pieces are held in a gap buffer: those before the gap are stored with their position and number of
+        preceding newlines, those after it relative to the end of the source, so an edit at the gap changes
+        nothing outside the edited rules, and moving the gap costs the number of rules it moves over
+        the lines and token indices of the nodes after the gap are shifted lazily, when the gap moves over them
+        or self.module is read
+        :param source: str holding the initial source code
+        :param module_name: name of self.module
+        """
+        self.length = 0
+        self.newline_count = 0
+        self.token_count = 0
+        # piece i is the text after rule i - 1 up to and including rule i, the last piece is the text after
+        # the last rule; before the gap starts[i] is the position of piece i and newlines[i] the number of
+        # newlines before it, and token_starts[i] the number of tokens before it
+        self.pieces = [""]
+        self.starts = [0]
+        self.newlines = [0]
+        self.token_starts = [0]
+        # pieces after the gap in reverse order, so the gap moves by popping and appending, with
+        # after_starts[k] the distance from piece k to the end of the source, and after_newlines[k] the
+        # number of newlines from piece k to the end of the source, and after_tokens[k] the number of tokens
+        self.after_pieces = []
+        self.after_starts = []
+        self.after_newlines = []
+        self.after_tokens = []
+        # number of lines and of tokens the nodes after the gap have moved by since they were last updated
+        self.shift = 0
+        self.token_shift = 0
+        self.head = Module([], module_name)
+        self.edit(0, 0, source)
+
+    @property
+    def module(self):
+        """
+        Module object holding the parsed nodes, with the lines and token indices of all of them up to date
+        """
+        if self.shift or self.token_shift:
+            for i in range(len(self.pieces), len(self.head.nodes)):
+                self.relocate(i, self.shift, self.token_shift)
+            self.shift = self.token_shift = 0
+        return self.head
+
+    @property
+    def source(self):
+        return "".join(self.pieces) + "".join(reversed(self.after_pieces))
+
+    def edit(self, start, end, text):
+        """
+        replaces source[start:end] with text, reparsing the affected top-level rules
+        the module's nodes are updated in place; if the edited source does not parse, the error is raised
+        and nothing is changed
+        :param start: position of the first replaced character
+        :param end: position after the last replaced character
+        :param text: replacement text
+        """
+        if not 0 <= start <= end <= self.length:
+            raise ValueError("edit out of range of source")
+        # the rule before the edited ones is reparsed as well, since an edit may turn the rule following an
+        # if into an elif or else of it
+        lo = max(self.piece(start, bisect_right) - 1, 0)
+        # an edit ending where a piece starts may join the piece before it with the text after the edit
+        self.move_gap(max(self.piece(end, bisect_left), lo) + 1)
+        region_start = self.starts[lo]
+        first_line = self.newlines[lo] + 1
+        first_token = self.token_starts[lo]
+        while True:
+            old = "".join(self.pieces[lo:])
+            region = old[:start - region_start] + text + old[end - region_start:]
+            try:
+                region_nodes, region_pieces, region_tokens = self.parse(region, first_line, first_token,
+                                                                        not self.after_pieces)
+                break
+            except (SyntaxError, EOFError):
+                # e.g. an opened string or block now reaches into the following rules
+                if not self.after_pieces:
+                    raise
+                self.move_gap(len(self.pieces) + 1)
+        delta = len(text) - (end - start)
+        line_delta = text.count("\n") - old.count("\n", start - region_start, end - region_start)
+        old_tokens = self.token_count - (self.after_tokens[-1] if self.after_tokens else 0) - first_token
+        token_delta = sum(region_tokens) - old_tokens
+        nodes = self.head.nodes
+        # rules outside the edit whose piece is unchanged hold the same text, so keep their nodes
+        reusable = {}
+        for i in range(lo, min(len(self.pieces), len(nodes))):
+            piece_start, size = self.starts[i], len(self.pieces[i])
+            if piece_start + size <= start:
+                reusable[piece_start, size] = nodes[i]
+            elif piece_start >= end:
+                reusable[piece_start + delta, size] = nodes[i]
+        position = region_start
+        for j, (node, piece) in enumerate(zip(region_nodes, region_pieces)):
+            reused = reusable.get((position, len(piece)))
+            if reused is not None:
+                # lines and tokens before the edit are unchanged, the parsed node has the position of the one
+                # after it
+                if reused.line != node.line or reused.start != node.start:
+                    self.move(reused, node.line - reused.line, node.start - reused.start)
+                region_nodes[j] = reused
+            position += len(piece)
+        nodes[lo:len(self.pieces)] = region_nodes
+        self.length += delta
+        self.newline_count += line_delta
+        self.token_count += token_delta
+        self.shift += line_delta
+        self.token_shift += token_delta
+        # the gap is now after the reparsed rules, so the pieces after it are unaffected
+        starts, newlines, token_starts = [], [], []
+        position, newline, token = region_start, first_line - 1, first_token
+        for piece, tokens in zip(region_pieces, region_tokens):
+            starts.append(position)
+            newlines.append(newline)
+            token_starts.append(token)
+            position += len(piece)
+            newline += piece.count("\n")
+            token += tokens
+        self.pieces[lo:] = region_pieces
+        self.starts[lo:] = starts
+        self.newlines[lo:] = newlines
+        self.token_starts[lo:] = token_starts
+        # positions of the old source's tokens are stale
+        self.head.positions = SourcePositions(self)
+        # compiled versions of the module are stale
+        self.head.compiled.clear()
+
+    def update(self, source):
+        """
+        replaces the whole source, e.g. when a file is saved, reparsing only the rules which changed
+        """
+        old = self.source
+        limit = min(len(old), len(source))
+        prefix = common_length(old, source, limit)
+        suffix = common_length(old[::-1], source[::-1], limit - prefix)
+        self.edit(prefix, len(old) - suffix, source[prefix:len(source) - suffix])
+
+    def piece(self, position, bisect):
+        """
+        :param bisect: bisect_right for the last piece starting at or before position, bisect_left for the
+        last piece starting before it (or the first piece)
+        :return: index of the piece
+        """
+        if position < self.length - (self.after_starts[-1] if self.after_starts else 0):
+            return max(bisect(self.starts, position) - 1, 0)
+        # after_starts is ordered from the end of the source, where other is the one for bisect_right
+        other = bisect_left if bisect is bisect_right else bisect_right
+        k = other(self.after_starts, self.length - position)
+        return len(self.pieces) + len(self.after_pieces) - 1 - k
+
+    def move_gap(self, i):
+        """
+        moves the gap to before piece i
+        """
+        pieces, starts, newlines, token_starts = self.pieces, self.starts, self.newlines, self.token_starts
+        while len(pieces) < i:
+            pieces.append(self.after_pieces.pop())
+            starts.append(self.length - self.after_starts.pop())
+            newlines.append(self.newline_count - self.after_newlines.pop())
+            token_starts.append(self.token_count - self.after_tokens.pop())
+            self.relocate(len(pieces) - 1, self.shift, self.token_shift)
+        while len(pieces) > i:
+            self.after_pieces.append(pieces.pop())
+            self.after_starts.append(self.length - starts.pop())
+            self.after_newlines.append(self.newline_count - newlines.pop())
+            self.after_tokens.append(self.token_count - token_starts.pop())
+            self.relocate(len(pieces), -self.shift, -self.token_shift)
+
+    def relocate(self, i, lines, tokens):
+        """
+        moves the node of piece i by a number of lines and of tokens, the last piece has no node
+        """
+        if (lines or tokens) and i < len(self.head.nodes):
+            self.move(self.head.nodes[i], lines, tokens)
+
+    def move(self, node, lines, tokens):
+        for child in walk([node]):
+            if child.line is not None:
+                child.line += lines
+            if child.start is not None:
+                child.start += tokens
+                child.end += tokens
+
+    def parse(self, region, first_line, first_token, last):
+        """
+        parses region, which must consist of whole pieces
+        :param first_line: number of the line region starts on
+        :param first_token: number of tokens in the source before region
+        :param last: True if region reaches the end of the source, so it ends with the last piece
+        :return: list of parsed nodes, list of the pieces of source they were parsed from, and list of the
+        number of tokens in every piece
+        """
+        tokens = Lexer(region).buffer()
+        if not last and (not region or region[-1] not in ";}" or tokens.end(len(tokens) - 1) != len(region)):
+            # the last token may continue past the region, so it does not end on a rule boundary
+            raise SyntaxError("edited region does not end on a rule boundary")
+        token_spans = []
+        parsed = Parser(Stream(tokens), spans=token_spans, first_line=first_line, first_token=first_token).head.nodes
+        pieces, counts, position, token = [], [], 0, 0
+        for _, last_token in token_spans:
+            end = tokens.end(last_token - 1)
+            pieces.append(region[position:end])
+            counts.append(last_token - token)
+            position, token = end, last_token
+        if last:
+            pieces.append(region[position:])
+            counts.append(len(tokens) - token)
+        return parsed, pieces, counts
+
+
+def common_length(a, b, limit):
+    """
+    :return: length of the longest common prefix of a and b, no longer than limit
+    """
+    low, high = 0, limit
+    # compare by halves, so the characters are compared by str's equality rather than one at a time
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
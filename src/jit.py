@@ -0,0 +1,52 @@
+import sys
+import time
+from compiler import ClosureCompiler
+from tree import *
+
+# FuncProfile objects of the functions compiled so far, in the order they were compiled
+compiled = []
+
+
+class JitCompiler(ClosureCompiler):
+    """
+    compiles the statements of a hot function into closures (see object.FuncProfile)
+    the functions called from compiled code may still be tree walked, and so return by raising ReturnValue,
+    which calls catch
+    """
+    def __init__(self):
+        super().__init__()
+        self.in_function = True
+
+    def compile_call(self, node):
+        call = super().compile_call(node)
+
+        def run(namespace):
+            try:
+                return call(namespace)
+            except ReturnValue as ret:
+                return ret.val
+        return run
+
+    handlers = {**ClosureCompiler.handlers, Call: compile_call}
+
+
+def compile_profile(profile):
+    """
+    compiles the statements of a function into profile.body, and records it in compiled
+    """
+    start = time.perf_counter()
+    profile.body = JitCompiler().compile_block(profile.statements)
+    profile.compiled_at = start
+    profile.compile_time = time.perf_counter() - start
+    compiled.append(profile)
+
+
+def report(start, file=sys.stderr):
+    """
+    prints every compiled function, with the counts which made it hot and when it was compiled
+    :param start: perf_counter time the program started running at
+    """
+    for profile in compiled:
+        print("{0}: compiled after {1} calls and {2} loop iterations, at {3:.3f}s, in {4:.2f}ms".format(
+            profile.name, profile.calls, profile.loop_iterations, profile.compiled_at - start,
+            profile.compile_time * 1000), file=file)
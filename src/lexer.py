@@ -1,171 +1,125 @@
+from array import array
+import codecs
+import re
 from tokens import *
 from stream import Stream
-import itertools
 
 
-def sorted_groupby(iterable, key=lambda x: x, reverse=True):
+def build_token_regex():
     """
-    sorts elements according to a key function, then groups them
-    :param iterable: the iterable to sort and group
-    :param key: key function by which elements are grouped
-    :param reverse: whether to reverse the order of the sorted elements or not
-    :return: tuples of the form (key value, group) in sorted order
+    builds a single regex matching any one lexeme, with a named group for every kind of lexeme
+    pre-defined tokens are tried longest first so that e.g. "**=" wins over "**" and "*"
+    control flow tokens only match when not followed by an identifier character, so "iffy" is an identifier
+    :return: compiled regex
     """
-    s = sorted(iterable, key=key, reverse=reverse)
-    return itertools.groupby(s, key)
+    identifier_char = "[{}]".format(re.escape(allowed_identifier_chars))
+    fixed = []
+    for token in sorted(token_types, key=len, reverse=True):
+        if token_types[token] is TokenType.CONTROL_FLOW:
+            fixed.append("{0}(?!{1})".format(re.escape(token), identifier_char))
+        else:
+            fixed.append(re.escape(token))
+    return re.compile("|".join((
+        r"(?P<space>[ \r\n]+)",
+        "(?P<token>{})".format("|".join(fixed)),
+        r'"(?P<double_quoted>(?:[^"\\]|\\.)*)"',
+        r"'(?P<single_quoted>(?:[^'\\]|\\.)*)'",
+        r"(?P<float>\d+\.\d*)",
+        r"(?P<int>\d+)",
+        "(?P<identifier>{}+)".format(identifier_char),
+    )), re.DOTALL)
+
+
+token_regex = build_token_regex()
 
 
-def unpack(grouped):
-    """
-    flattens a groupby object
-    :param grouped: itertools.groupby object
-    :return: list containing tuples of form (key_val, element) for every element in all groups
-    """
-    return tuple(
-        (key_val, e) for key_val, group in grouped
-        for e in group
-    )
-
-
-# TODO: refactor code by replacing Scanner with a Stream
-class Scanner:
-    def __init__(self, source):
-        self.pos = 0
-        self.source = source
-        self.len = len(source)
-
-    def stream(self):
-        """
-        streams characters from source
-        :yield: tuples of form (index, char) similar to enumerate()
-        """
-        while self.pos < len(self.source):
-            yield self.pos, self.source[self.pos]
-            self.pos += 1
-
-    def peek(self, n):
-        """
-        get source n characters ahead from current position without advancing self.pos
-        :param n: how many characters to peek ahead
-        :return: next n characters of source
-        """
-        return self.source[self.pos: self.pos + n]
-
-    def peek_at(self, n):
-        """
-        get specific character n indices ahead of current position without advancing self.pos
-        :param n: how many characters to peek ahead
-        :return: character at self.pos + n
-        """
-        if self.pos + n < self.len:
-            return self.source[self.pos + n]
-
-    def advance(self, n):
+class Lexer:
+    def __init__(self, source, chunk_size=1 << 16):
         """
-        advances current position n times ahead
-        :param n: how many steps to advance
+        :param source: str, file object (text or binary) or mmap to read source code from
+        :param chunk_size: how much of a file-like source is read at a time
         """
-        self.pos += n
-
-
-class Lexer:
-    def __init__(self, source):
-        self.scanner = Scanner(source)
+        self.source = source
+        self.chunk_size = chunk_size
 
     def tokenize(self):
-        return Stream(self._tokenize())
+        return Stream(self.buffer())
 
-    def _tokenize(self):
+    def buffer(self):
         """
-        performs lexical analysis on source to split it into more easily parsed tokens
-        :yield: Token objects
+        :return: TokenBuffer holding every token of source
         """
-        sorted_token_types = unpack(sorted_groupby(token_types, key=lambda x: len(x)))
-        for index, char in self.scanner.stream():
-            if char in (" ", "\n"):
-                continue
-            # check if the index is the start of a pre-defined token
-            for length, token in sorted_token_types:
-                if self.scanner.peek(length) == token:
-                    if not (
-                            token_types[token] is TokenType.CONTROL_FLOW and
-                            self.scanner.peek_at(length) in allowed_identifier_chars
-                    ):
-                        yield Token(token, token_type=token_types[token])
-                        self.scanner.advance(length - 1)
-                    break
-            else:
-                # check if the character is the start of a string
-                if char in "\"'":
-                    string = self.read_string(char)
-                    yield Token(string, token_type=TokenType.VALUE)
-                # check if the character is the start of an int or float
-                elif char.isdigit():
-                    num, is_float = self.read_num()
-                    yield Token(float(num) if is_float else int(num), token_type=TokenType.VALUE)
-                # check if the character is the start of an identifier
-                elif char in allowed_identifier_chars:
-                    identifier = self.read_identifier()
-                    yield Token(identifier, token_type=TokenType.IDENTIFIER)
-                else:
-                    raise SyntaxError("improper token found")
+        buffer = TokenBuffer()
+        append = buffer.append
+        for code, value, offset in self.lex(buffer.line_starts):
+            append(code, value, offset)
+        return buffer.finish()
 
-    def read_string(self, quote_type):
+    def chunks(self):
         """
-        reads from scanner until end quote
-        :param quote_type: type of quotation to read until
-        :return: read string
+        reads source in fixed-size pieces, so that only one piece needs to be held in memory at a time
+        :yield: successive pieces of source as strings
         """
-        string = ""
-        i = 1
-        while True:
-            s = self.scanner.peek_at(i)
-            i += 1
-            if s is None or (s == quote_type and string[-1] != "\\"):
-                break
-            string += s
-        # advance scanner and yield string token
-        self.scanner.advance(i - 1)
-        return string
+        if isinstance(self.source, str):
+            yield self.source
+            return
+        decoder = None
+        while chunk := self.source.read(self.chunk_size):
+            if isinstance(chunk, (bytes, bytearray)):
+                if decoder is None:
+                    decoder = codecs.getincrementaldecoder("utf-8")()
+                chunk = decoder.decode(chunk)
+            yield chunk
+        if decoder is not None:
+            yield decoder.decode(b"", final=True)
 
-    def read_num(self):
+    def lex(self, line_starts=None):
         """
-        reads from scanner until a non-numeric character
-        :return: tuple containing the read number and whether it was a float
-        """
-        num = ""
-        is_float = False
-        i = 0
-        while True:
-            s = self.scanner.peek_at(i)
-            if s is None:
-                break
-            if s.isdigit():
-                num += s
-            elif s == "." and not is_float:
-                num += s
-                is_float = True
-            else:
-                break
-            i += 1
-        # advance scanner and yield int/float token
-        self.scanner.advance(i - 1)
-        return num, is_float
-
-    def read_identifier(self):
-        """
-        reads from scanner until non-valid identifier character
-        :return: read identifier
-        """
-        identifier = ""
-        i = 0
+        performs lexical analysis on source to split it into more easily parsed tokens
+        :param line_starts: array receiving the offset of the first character of every line after the first
+        :yield: tuples of form (token code, value, offset of the token in source)
+        """
+        if line_starts is None:
+            # still needed to locate errors
+            line_starts = array("Q", [0])
+        match = token_regex.match
+        chunks = self.chunks()
+        buffer, pos, eof = "", 0, False
+        # offset in source of the start of buffer
+        base = 0
         while True:
-            s = self.scanner.peek_at(i)
-            if s is not None and s in allowed_identifier_chars:
-                identifier += s
+            m = None if pos == len(buffer) else match(buffer, pos)
+            # a lexeme reaching the end of the buffer may continue in the next chunk
+            if not eof and (m is None or m.end() == len(buffer)):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    eof = True
+                else:
+                    chunk_start = base + len(buffer)
+                    newline = chunk.find("\n")
+                    while newline != -1:
+                        line_starts.append(chunk_start + newline + 1)
+                        newline = chunk.find("\n", newline + 1)
+                    buffer, base, pos = buffer[pos:] + chunk, base + pos, 0
+                continue
+            if m is None:
+                if pos == len(buffer):
+                    return
+                elif buffer[pos] in "\"'":
+                    raise SyntaxError("unterminated string at {}".format(location(line_starts, base + pos)))
+                raise SyntaxError("improper token found at {}".format(location(line_starts, base + pos)))
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "space":
+                continue
+            offset = base + m.start()
+            if kind == "token":
+                yield token_codes[m.group(kind)], None, offset
+            elif kind == "identifier":
+                yield IDENTIFIER_CODE, m.group(kind), offset
+            elif kind == "int":
+                yield VALUE_CODE, int(m.group(kind)), offset
+            elif kind == "float":
+                yield VALUE_CODE, float(m.group(kind)), offset
             else:
-                break
-            i += 1
-        # advance scanner and yield identifier token
-        self.scanner.advance(i - 1)
-        return identifier
+                yield VALUE_CODE, m.group(kind), offset
@@ -0,0 +1,157 @@
+import json
+import sys
+import weakref
+from namespace import Namespace, Frame
+from optimizer import walk
+
+# fields of Metrics in the order they are reported, with a description used as Prometheus help text
+fields = (
+    ("tokens", "number of tokens lexed"),
+    ("nodes", "number of nodes in the tree that ran"),
+    ("lex_time", "seconds spent lexing"),
+    ("parse_time", "seconds spent parsing, or loading the tree from the parse cache"),
+    ("optimize_time", "seconds spent optimizing the tree"),
+    ("exec_time", "seconds spent running the module"),
+    ("calls", "number of coral function calls which ran the function's body"),
+    ("peak_namespace", "largest number of names held by a single namespace")
+)
+
+
+class Metrics:
+    def __init__(self, file=None, backend=None):
+        """
+        measurements of one run of a module through coral.run, fields which were not measured are None
+        the lexer and parser are only timed apart when they are given a Metrics object, and calls and
+        namespaces are only counted while run_instrumented runs, by replacing Namespace.__init__ and
+        Frame.__init__ at class level, so nothing is measured when no Metrics object is given
+        """
+        self.file = file
+        self.backend = backend
+        self.cache_hit = False
+        self.tokens = None
+        self.nodes = None
+        self.lex_time = None
+        self.parse_time = None
+        self.optimize_time = None
+        self.exec_time = None
+        self.calls = None
+        self.peak_namespace = None
+
+    def count_nodes(self, module):
+        self.nodes = sum(1 for _ in walk(module.nodes))
+
+    def run_instrumented(self, module, backend):
+        """
+        runs module, counting calls and measuring namespaces
+        every call of a coral function creates one local Namespace, or one Frame on the resolved backend, so
+        calls are counted from those, which covers calls made inside the vm of the bytecode backend as well
+        the python backend runs coral functions as python functions, so they are not counted on it
+        a Namespace is measured when it is freed, or when the module has run if it is still alive, and a
+        Frame by its number of slots
+        :param backend: function of form f(module) running the module, e.g. Module.run_compiled
+        """
+        namespace_init, frame_init = Namespace.__init__, Frame.__init__
+        live = set()
+        self.calls = self.peak_namespace = 0
+        metrics = self
+
+        def measure(size):
+            if size > metrics.peak_namespace:
+                metrics.peak_namespace = size
+
+        def track(namespace):
+            obj_dict = namespace.obj_dict
+
+            def freed(ref):
+                live.discard(ref)
+                measure(len(obj_dict))
+            live.add(weakref.ref(namespace, freed))
+
+        def __init__(namespace, parent=None, obj_dict=None):
+            namespace_init(namespace, parent, obj_dict)
+            metrics.calls += 1
+            track(namespace)
+
+        def frame__init__(frame, parent, slots):
+            frame_init(frame, parent, slots)
+            # the module's frame has no parent
+            if parent is not None:
+                metrics.calls += 1
+            measure(len(slots))
+
+        Namespace.__init__, Frame.__init__ = __init__, frame__init__
+        try:
+            backend(module)
+        finally:
+            Namespace.__init__, Frame.__init__ = namespace_init, frame_init
+            for ref in list(live):
+                namespace = ref()
+                if namespace is not None:
+                    measure(len(namespace.obj_dict))
+            live.clear()
+            measure(len(module.namespace.obj_dict))
+
+    def as_dict(self):
+        return {
+            "file": self.file,
+            "backend": self.backend,
+            "cache_hit": self.cache_hit,
+            **{name: getattr(self, name) for name, _ in fields}
+        }
+
+    def report(self, file=sys.stderr):
+        """
+        prints the measurements, one per line
+        """
+        print("{0} ({1} backend{2})".format(self.file, self.backend, ", cached" if self.cache_hit else ""),
+              file=file)
+        for name, _ in fields:
+            value = getattr(self, name)
+            if value is None:
+                value = "-"
+            elif name.endswith("_time"):
+                value = "{:.6f}s".format(value)
+            print("  {0:<15}{1:>14}".format(name, value), file=file)
+
+    def write_json(self, file):
+        """
+        writes the measurements as one line of JSON, so runs can be appended to the same file
+        """
+        print(json.dumps(self.as_dict()), file=file)
+
+    def write_prometheus(self, file):
+        """
+        writes the measurements in the Prometheus text exposition format, labelled by file and backend
+        fields which were not measured are left out
+        """
+        labels = '{{file="{0}",backend="{1}"}}'.format(escape(self.file), escape(self.backend))
+        for name, description in fields:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            metric = "coral_" + (name[:-len("_time")] + "_seconds" if name.endswith("_time") else name)
+            print("# HELP {0} {1}".format(metric, description), file=file)
+            print("# TYPE {} gauge".format(metric), file=file)
+            print("{0}{1} {2}".format(metric, labels, value), file=file)
+        print("# HELP coral_cache_hit whether the tree was loaded from the parse cache", file=file)
+        print("# TYPE coral_cache_hit gauge", file=file)
+        print("coral_cache_hit{0} {1}".format(labels, int(self.cache_hit)), file=file)
+
+    def emit(self, path, format="json"):
+        """
+        writes the measurements to the file at path, appending a line of JSON, or replacing the file with
+        Prometheus text, as a node exporter textfile collector expects
+        :param format: "json" or "prometheus"
+        """
+        if format == "json":
+            with open(path, "a") as f:
+                self.write_json(f)
+        elif format == "prometheus":
+            with open(path, "w") as f:
+                self.write_prometheus(f)
+        else:
+            raise ValueError("unknown metrics format {}".format(format))
+
+
+def escape(label):
+    return str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,4 +1,9 @@
 class Namespace:
+    # bumped whenever a name is added to the namespace through push, or obj_dict was written to directly
+    # inline caches (see tree.ObjectLookup) trust a lookup for as long as the namespaces it went through keep
+    # their versions, rebinding a name does not bump it, as it cannot change where the name is found
+    version = 0
+
     def __init__(self, parent=None, obj_dict=None):
         self.parent = parent
         if obj_dict is not None:
@@ -15,4 +20,24 @@ class Namespace:
             raise LookupError
 
     def push(self, name, value):
+        if name not in self.obj_dict:
+            self.version += 1
         self.obj_dict[name] = value
+
+
+# marks frame slots whose name has not been bound yet
+UNBOUND = object()
+
+
+class Frame:
+    __slots__ = ("slots", "display")
+
+    def __init__(self, parent, slots):
+        """
+        namespace whose names were resolved ahead of time (see resolver.py) into indices of a fixed-size list
+        :param parent: Frame of the enclosing scope (None for the module)
+        :param slots: list of values, UNBOUND for names which have not been bound yet
+        """
+        self.slots = slots
+        # slots of every enclosing frame indexed by depth, so that outer names are a single index away
+        self.display = (slots,) if parent is None else parent.display + (slots,)
@@ -1,14 +1,19 @@
-from namespace import Namespace
+from collections import OrderedDict
+from namespace import Namespace, Frame, UNBOUND
 from textwrap import indent
 
 
 class Func:
-    def __init__(self, scope, name, args, statements):
+    def __init__(self, scope, name, args, statements, profile=None):
+        """
+        :param profile: FuncProfile of the definition which created the function, None to always tree walk
+        """
         self.scope = scope
         self.name = name
         self.args = args
         self.arity = len(args)
         self.statements = statements
+        self.profile = profile
 
     def __str__(self):
         body = "args : {0},\n{1}".format(", ".join(self.args), self.statements)
@@ -19,11 +24,155 @@ class Func:
         if num_args == self.arity:
             obj_dict = dict(zip(self.args, arg_vals))
             local_scope = Namespace(parent=self.scope, obj_dict=obj_dict)
+            profile = self.profile
+            if profile is not None and (profile.body is not None or profile.count_call()):
+                # compiled bodies return a 1-tuple instead of raising ReturnValue
+                ret = profile.body(local_scope)
+                if ret is not None:
+                    return ret[0]
+                return None
             for statement in self.statements:
                 statement.exec(local_scope)
         else:
-            raise TypeError(
-                "attempted to pass {0} arguments to function {1} of arity {2}".format(
-                    num_args, self.name, self.arity
-                )
+            raise self.arity_error(num_args)
+
+    def arity_error(self, num_args):
+        return TypeError(
+            "attempted to pass {0} arguments to function {1} of arity {2}".format(
+                num_args, self.name, self.arity
             )
+        )
+
+
+class FuncProfile:
+    # calls, and loop iterations, after which a function is compiled (None to never compile because of them)
+    call_threshold = 100
+    loop_threshold = 1000
+
+    def __init__(self, name, statements):
+        """
+        execution counts of a function definition, shared by every Func it creates, which decide when the
+        function is tiered up from tree walking to closures compiled by jit.JitCompiler
+        loop iterations are added by the function's While nodes, and only checked on the next call, so a
+        hot loop is compiled for the calls after the one running it
+        """
+        self.name = name
+        self.statements = statements
+        self.calls = 0
+        self.loop_iterations = 0
+        # compiled closure of the statements, None while the function is tree walked
+        self.body = None
+        # perf_counter time at which the function was compiled, and how long compiling it took
+        self.compiled_at = None
+        self.compile_time = None
+
+    def hot(self):
+        return (self.call_threshold is not None and self.calls >= self.call_threshold
+                or self.loop_threshold is not None and self.loop_iterations >= self.loop_threshold)
+
+    def count_call(self):
+        """
+        counts a call of the function, compiling it if it has become hot
+        :return: whether the function is compiled
+        """
+        self.calls += 1
+        if not self.hot():
+            return False
+        # jit imports the compiler, which imports this module
+        from jit import compile_profile
+        compile_profile(self)
+        return True
+
+
+class CompiledFunc(Func):
+    def __init__(self, scope, name, args, statements, body):
+        """
+        function whose statements were compiled into a closure by compiler.ClosureCompiler
+        :param body: compiled closure of form f(namespace) returning None or a 1-tuple holding the return value
+        """
+        super().__init__(scope, name, args, statements)
+        self.body = body
+
+    def __call__(self, *arg_vals):
+        if len(arg_vals) != self.arity:
+            raise self.arity_error(len(arg_vals))
+        ret = self.body(Namespace(parent=self.scope, obj_dict=dict(zip(self.args, arg_vals))))
+        if ret is not None:
+            return ret[0]
+
+
+class FrameFunc(Func):
+    def __init__(self, scope, name, args, statements, size):
+        """
+        function whose names were resolved into slots by resolver.Resolver
+        :param scope: Frame the function was defined in
+        :param size: number of slots in the function's frame, parameters taking the first ones
+        """
+        super().__init__(scope, name, args, statements)
+        self.padding = [UNBOUND] * (size - self.arity)
+
+    def __call__(self, *arg_vals):
+        if len(arg_vals) != self.arity:
+            raise self.arity_error(len(arg_vals))
+        local_scope = Frame(self.scope, [*arg_vals, *self.padding])
+        for statement in self.statements:
+            statement.exec(local_scope)
+
+
+class BytecodeFunc(Func):
+    def __init__(self, scope, code, vm):
+        """
+        function whose body was compiled to a bytecode.CodeObject
+        :param code: CodeObject of the function body, which stands in for its statements
+        :param vm: vm.VM which runs the function when it is called from outside of the vm
+        """
+        super().__init__(scope, code.name, code.args, code)
+        self.code = code
+        self.vm = vm
+
+    def __call__(self, *arg_vals):
+        if len(arg_vals) != self.arity:
+            raise self.arity_error(len(arg_vals))
+        return self.vm.execute(self.code, Namespace(parent=self.scope, obj_dict=dict(zip(self.args, arg_vals))))
+
+
+class MemoFunc:
+    # number of results cached per function unless given otherwise
+    size = 128
+
+    def __init__(self, func, size=None):
+        """
+        wraps a pure function, caching its results by argument values and evicting the least recently used
+        :param func: function of any backend, called on cache misses
+        :param size: maximum number of cached results (MemoFunc.size if None)
+        """
+        self.func = func
+        self.name = getattr(func, "name", getattr(func, "__name__", None))
+        self.arity = getattr(func, "arity", None)
+        self.size = MemoFunc.size if size is None else size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return str(self.func)
+
+    def __call__(self, *arg_vals):
+        # types are part of the key so that e.g. 1, 1.0 and true stay distinct
+        key = (*arg_vals, *map(type, arg_vals))
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        # tree imports this module, so ReturnValue cannot be imported at the top
+        from tree import ReturnValue
+        try:
+            value = self.func(*arg_vals)
+        except ReturnValue as ret:
+            value = ret.val
+        cache[key] = value
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+        return value
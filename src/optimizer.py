@@ -0,0 +1,416 @@
+import operator
+from collections import Counter
+from tree import *
+from tokens import operator_symbols
+from resolver import assigned_names
+
+# names of builtin constants, which are folded unless the module binds them itself
+literal_names = {"true": True, "false": False, "null": None}
+# folded strings and numbers are kept below this size, so folding cannot bloat the tree
+fold_limit = 4096
+
+
+def walk(nodes):
+    """
+    :param nodes: list of nodes
+    :yield: every node in nodes and below them, in preorder
+    """
+    for node in nodes:
+        if node is None:
+            continue
+        yield node
+        for attr, kind in node_fields.get(type(node), ()):
+            if kind == "node":
+                yield from walk([getattr(node, attr)])
+            elif kind == "nodes":
+                yield from walk(getattr(node, attr))
+
+
+def bound_names(nodes):
+    """
+    :return: set of every name assigned, defined or used as a parameter anywhere in nodes
+    """
+    names = set()
+    for node in walk(nodes):
+        if isinstance(node, (Assignment, FuncDef)):
+            names.add(node.name)
+        if isinstance(node, FuncDef) and node.args:
+            names.update(node.args)
+    return names
+
+
+def dump_tree(nodes):
+    """
+    :return: indented text describing nodes, one line per node
+    """
+    lines = []
+
+    def describe(node, depth, label=""):
+        details, children = [], []
+        for attr, kind in node_fields.get(type(node), ()):
+            value = getattr(node, attr)
+            if kind == "node":
+                if value is not None:
+                    children.append((attr, value))
+            elif kind == "nodes":
+                children.extend((attr, child) for child in value)
+            elif kind == "operator":
+                details.append(operator_symbols[value])
+            elif kind == "names":
+                details.append("({})".format(", ".join(value or ())))
+            elif kind == "constant":
+                details.append(repr(value))
+            else:
+                details.append(value)
+        lines.append("{0}{1}{2}".format("    " * depth, label, " ".join([type(node).__name__, *map(str, details)])))
+        for attr, child in children:
+            describe(child, depth + 1, attr + ": ")
+    for node in nodes:
+        describe(node, 0)
+    return "\n".join(lines)
+
+
+class Pass:
+    """
+    rewrites a tree bottom up, leaving the original tree untouched
+    handlers map node types to functions receiving a copy of the node whose children were already
+    rewritten, and returning its replacement
+    a statement may be replaced by a list of statements, which is spliced into the enclosing block, or by
+    None, which removes it
+    """
+    name = None
+    handlers = {}
+
+    def run(self, nodes):
+        """
+        :param nodes: list of the module's statements
+        :return: list of rewritten statements
+        """
+        return self.rewrite_block(nodes)
+
+    def rewrite_block(self, statements):
+        block = []
+        for statement in statements:
+            statement = self.rewrite(statement)
+            if isinstance(statement, list):
+                block.extend(statement)
+            elif statement is not None:
+                block.append(statement)
+        return block
+
+    def rewrite(self, node):
+        fields = node_fields.get(type(node))
+        if fields is None:
+            return node
+        node = type(node)(*(self.rewrite_field(getattr(node, attr), kind) for attr, kind in fields)).locate(node)
+        handler = self.handlers.get(type(node))
+        if handler is None:
+            return node
+        return handler(self, node)
+
+    def rewrite_field(self, value, kind):
+        if kind == "node":
+            return None if value is None else self.rewrite(value)
+        elif kind == "nodes":
+            return self.rewrite_block(value)
+        return value
+
+
+class ConstantFolding(Pass):
+    """
+    evaluates operators whose operands are constants ahead of time
+    """
+    name = "fold"
+
+    def __init__(self):
+        self.constants = {}
+
+    def run(self, nodes):
+        bound = bound_names(nodes)
+        self.constants = {name: value for name, value in literal_names.items() if name not in bound}
+        return super().run(nodes)
+
+    def fold_object_lookup(self, node):
+        if node.name in self.constants:
+            return Value(self.constants[node.name])
+        return node
+
+    def fold_binary_operator(self, node):
+        if isinstance(node.left, Value) and isinstance(node.right, Value):
+            if result_size(node.func, node.left.value, node.right.value) >= fold_limit:
+                return node
+            try:
+                value = node.func(node.left.value, node.right.value)
+            except Exception:
+                # left for the error to be raised when (and if) the expression runs
+                return node
+            if isinstance(value, (str, int, float)) and size(value) < fold_limit:
+                return Value(value)
+        return node
+
+    def fold_logical_and(self, node):
+        if isinstance(node.left, Value):
+            return node.right if node.left.value else node.left
+        return node
+
+    def fold_logical_or(self, node):
+        if isinstance(node.left, Value):
+            return node.left if node.left.value else node.right
+        return node
+
+    handlers = {
+        ObjectLookup: fold_object_lookup,
+        BinaryOperator: fold_binary_operator,
+        LogicalAnd: fold_logical_and,
+        LogicalOr: fold_logical_or
+    }
+
+
+def size(value):
+    if isinstance(value, str):
+        return len(value)
+    elif isinstance(value, int):
+        return value.bit_length()
+    return 0
+
+
+def result_size(func, left, right):
+    """
+    upper bound on the size of func(left, right), worked out from the operands without computing it, as
+    CPython's AST optimizer does, for the operators whose result can be far larger than their operands
+    :return: the bound, or 0 for results which are no larger than their operands
+    """
+    if func is operator.mul:
+        if isinstance(left, int) and isinstance(right, int):
+            return left.bit_length() + right.bit_length()
+        elif isinstance(left, str) and isinstance(right, int):
+            return len(left) * right
+        elif isinstance(left, int) and isinstance(right, str):
+            return left * len(right)
+    elif func is operator.pow:
+        if isinstance(left, int) and isinstance(right, int) and right > 0:
+            return left.bit_length() * right
+    elif func is operator.lshift:
+        if isinstance(left, int) and isinstance(right, int) and right > 0 and left:
+            return left.bit_length() + right
+    return 0
+
+
+class DeadBranchElimination(Pass):
+    """
+    removes branches of if/elif/else chains and loops whose condition is a constant
+    """
+    name = "dead-branches"
+
+    def rewrite_block(self, statements):
+        block = []
+        for statement in super().rewrite_block(statements):
+            # a chain whose first condition always holds is just its block
+            if isinstance(statement, Conditional) and isinstance(statement.condition, Value):
+                block.extend(statement.statements)
+            else:
+                block.append(statement)
+        return block
+
+    def eliminate_conditional(self, node):
+        if not isinstance(node.condition, Value):
+            return node
+        elif node.condition.value:
+            # the following links can never be reached
+            return Conditional(Value(True), node.statements)
+        # next_node has already been eliminated, and None removes the whole chain
+        return node.next_node
+
+    def eliminate_while(self, node):
+        if isinstance(node.condition, Value) and not node.condition.value:
+            return None
+        return node
+
+    handlers = {
+        Conditional: eliminate_conditional,
+        While: eliminate_while
+    }
+
+
+class InvariantHoisting(Pass):
+    """
+    moves expressions whose operands are not assigned in a loop's body out of the loop, into temporaries
+    computed once before it, and unbound after it
+    invariants of the condition are computed right before the loop, as the condition runs at least once
+    anyway; invariants of the body are computed behind an extra test of the condition, so they only run if
+    the body would, and are taken only from the statements up to the first one binding or printing anything
+    (or calling a function, which may do both), as an invariant which raises must not do so before the
+    effects of the statements ahead of it
+    """
+    name = "hoist"
+
+    def __init__(self):
+        self.temporaries = 0
+
+    def hoist_while(self, node):
+        assigned = assigned_names(node.statements)
+        hoisted = []
+        condition = self.hoist(node.condition, assigned, hoisted)
+        body_hoisted = []
+        statements = list(node.statements)
+        if not any(isinstance(n, Call) for n in walk([condition])):
+            for i, statement in enumerate(statements):
+                if any(isinstance(n, Call) for n in walk([statement])):
+                    break
+                elif isinstance(statement, Expression):
+                    statements[i] = self.hoist(statement, assigned, body_hoisted)
+                    continue
+                elif isinstance(statement, Assignment):
+                    statements[i] = Assignment(statement.name, self.hoist(statement.value, assigned, body_hoisted))
+                elif isinstance(statement, Output):
+                    statements[i] = Output(self.hoist(statement.expression, assigned, body_hoisted))
+                elif isinstance(statement, Return):
+                    statements[i] = Return(self.hoist(statement.expr, assigned, body_hoisted))
+                break
+        loop = While(condition, statements if body_hoisted else node.statements).locate(node)
+        if body_hoisted:
+            loop = Conditional(condition, body_hoisted + [loop, self.unbind(body_hoisted, node)]).locate(node)
+        if hoisted:
+            return hoisted + [loop, self.unbind(hoisted, node)]
+        return loop
+
+    def unbind(self, hoisted, node):
+        """
+        :return: statement unbinding the temporaries assigned by hoisted, so they do not outlive the loop
+        """
+        return Unbind(tuple(assignment.name for assignment in hoisted)).locate(node)
+
+    def hoist(self, node, assigned, hoisted):
+        """
+        replaces the largest invariant subexpressions of node with lookups of temporaries
+        :param assigned: names assigned in the loop
+        :param hoisted: list receiving the assignments of the temporaries
+        :return: rewritten expression
+        """
+        if isinstance(node, BinaryOperator) and self.invariant(node, assigned):
+            name = "λinvariant{}".format(self.temporaries)
+            self.temporaries += 1
+            hoisted.append(Assignment(name, node))
+            return ObjectLookup(name)
+        elif isinstance(node, BinaryOperator):
+            return BinaryOperator(node.func, self.hoist(node.left, assigned, hoisted),
+                                  self.hoist(node.right, assigned, hoisted))
+        elif isinstance(node, Call):
+            return Call(node.func_name, [self.hoist(arg, assigned, hoisted) for arg in node.arg_vals])
+        return node
+
+    def invariant(self, node, assigned):
+        if isinstance(node, Value):
+            return True
+        elif isinstance(node, ObjectLookup):
+            return node.name not in assigned
+        elif isinstance(node, BinaryOperator):
+            return self.invariant(node.left, assigned) and self.invariant(node.right, assigned)
+        return False
+
+    handlers = {
+        While: hoist_while
+    }
+
+
+def module_bindings(nodes):
+    """
+    :return: Counter of how many times each name is bound in the module's own scope
+    """
+    counts = Counter()
+    for node in nodes:
+        if isinstance(node, (Assignment, FuncDef)):
+            counts[node.name] += 1
+        elif isinstance(node, ControlFlowElement):
+            while node is not None:
+                counts.update(module_bindings(node.statements))
+                node = getattr(node, "next_node", None)
+    return counts
+
+
+def pure_functions(nodes):
+    """
+    finds the module-level functions whose result depends only on their arguments
+    a function is pure if it prints nothing, defines no functions, and only reads its parameters, its
+    locals, the builtin constants and other pure functions
+    locals which are also bound by the module are not trusted, as they fall back to the module's binding
+    while unassigned, and pure functions must be bound only once in the module
+    functions annotated with @memo are taken to be pure, and ones annotated with @nomemo to be impure
+    :return: set of names of pure functions
+    """
+    bindings = module_bindings(nodes)
+    bound = bound_names(nodes)
+    constants = set(literal_names) - bound
+    module_names = set(bindings) | set(Module.builtins)
+    functions = {node.name: node for node in nodes
+                 if isinstance(node, FuncDef) and node.memo is not False and bindings[node.name] == 1}
+
+    def is_pure(func, pure):
+        params = set(func.args or ())
+        local_names = assigned_names(func.statements) - params
+        for node in walk(func.statements):
+            if isinstance(node, (Output, FuncDef)):
+                return False
+            elif isinstance(node, (ObjectLookup, Call)):
+                name = node.name if isinstance(node, ObjectLookup) else node.func_name
+                if name in params or name in local_names:
+                    # calling a parameter or local could run anything
+                    if isinstance(node, Call) or name in local_names and name in module_names:
+                        return False
+                elif name not in constants and name not in pure:
+                    return False
+        return True
+
+    # assume every candidate is pure and drop impure ones until nothing changes, which lets mutually
+    # recursive functions be pure
+    pure = set(functions)
+    changed = True
+    while changed:
+        impure = {name for name in pure if not functions[name].memo and not is_pure(functions[name], pure)}
+        pure -= impure
+        changed = bool(impure)
+    return pure
+
+
+class Memoization(Pass):
+    """
+    makes calls to pure functions go through a MemoFunc cache of their results
+    """
+    name = "memoize"
+
+    def run(self, nodes):
+        pure = pure_functions(nodes)
+        return [self.memoize(node) if isinstance(node, FuncDef) and node.memo is None and node.name in pure
+                else node for node in nodes]
+
+    def memoize(self, node):
+        return FuncDef(node.name, node.args, node.statements, True).locate(node)
+
+
+default_passes = (ConstantFolding, DeadBranchElimination, InvariantHoisting, Memoization)
+
+
+class Optimizer:
+    def __init__(self, passes=default_passes, dump=None):
+        """
+        runs a pipeline of passes over a parsed module
+        :param passes: Pass subclasses, run in order
+        :param dump: file the tree is written to before and after every pass (None to not dump)
+        """
+        self.passes = passes
+        self.dump = dump
+
+    def optimize(self, module):
+        """
+        :param module: Module object, which is left untouched
+        :return: new Module object holding the optimized tree
+        """
+        nodes = module.nodes
+        for pass_type in self.passes:
+            optimization = pass_type()
+            if self.dump is not None:
+                print("--- before {} ---".format(optimization.name), dump_tree(nodes), sep="\n", file=self.dump)
+            nodes = optimization.run(nodes)
+            if self.dump is not None:
+                print("--- after {} ---".format(optimization.name), dump_tree(nodes), sep="\n", file=self.dump)
+        return Module(nodes, module.name, module.positions)
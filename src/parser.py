@@ -5,55 +5,118 @@ from pattern import *
 
 # TODO: update/add docstrings
 class Parser:
-    def __init__(self, token_stream, module_name="main"):
+    def __init__(self, token_stream, module_name="main", spans=None, first_line=1, first_token=0):
         """
         :param token_stream: Stream object from lexer
         :param module_name: string used to name the Module object assigned to self.head
+        :param spans: list receiving the (start, end) token indices of every top-level rule
+        :param first_line: line number of the first line of the stream's source
+        :param first_token: index the stream's first token has in the source, which the start and end of the
+        parsed nodes count from (spans count from the stream's first token)
         """
         self.token_stream = token_stream
-        self.head = Module(self.parse(), module_name)
+        # streams of a TokenBuffer know the line of every token, which is recorded on every parsed rule
+        self.lines = token_stream.tokens if isinstance(token_stream.tokens, TokenBuffer) else None
+        self.first_line = first_line
+        self.first_token = first_token
+        nodes = self.parse(spans=spans)
+        self.head = Module(nodes, module_name, None if self.lines is None else self.lines.positions())
 
-    def parse(self, token_stream=None, patterns=None, raise_error=True):
+    def parse(self, token_stream=None, patterns=None, raise_error=True, spans=None):
         """
         parse token_stream against a patterns dict
-        :param patterns: dict of form {pattern: func}
+        :param patterns: DispatchTable or dict of form {pattern: func}
+        :param spans: list receiving the (start, end) indices in token_stream's tokens of every parsed rule
         :return: list of Statement nodes
         """
         if patterns is None:
-            patterns = Parser.patterns
+            patterns = Parser.dispatch
+        elif isinstance(patterns, dict):
+            patterns = DispatchTable(patterns)
         if token_stream is None:
             token_stream = self.token_stream
+        # rules parsing more than their match (an if's elif and else blocks) read on from the stream being parsed
+        outer_stream, self.token_stream = self.token_stream, token_stream
         parsed = []
         while token_stream:
-            for pattern, func in patterns.items():
+            start = token_stream.start
+            for pattern, func in patterns.candidates(token_stream.peek()):
                 m = pattern.match(token_stream)
                 if m:
                     if isinstance(pattern, CombinedPattern):
                         parsed.append(func(self, *m.groups))
                     else:
                         parsed.append(func(self, m.groups))
+                    node = parsed[-1]
+                    self.span(node, start, token_stream.start)
+                    if self.lines is not None:
+                        node.line = self.lines.line(start) + self.first_line - 1
+                    if spans is not None:
+                        spans.append((start, token_stream.start))
                     break
             else:
                 if raise_error:
-                    raise SyntaxError
+                    raise SyntaxError("unable to parse statement at {}".format(self.location(token_stream.start)))
                 else:
                     break
+        self.token_stream = outer_stream
         return parsed
 
-    def parse_assignment(self, identifier, expr):
+    def span(self, node, start, end):
+        """
+        records the indices in the parsed stream of node's first token and of the token after its last on node
+        """
+        node.start, node.end = start + self.first_token, end + self.first_token
+
+    def position(self, i):
+        """
+        :param i: index of a token in the parsed stream
+        :return: (line, column) of the token, or None if the stream does not know where its tokens are
+        """
+        if self.lines is None or not 0 <= i < len(self.lines):
+            return None
+        line, column = self.lines.position(i)
+        return line + self.first_line - 1, column
+
+    def location(self, i):
+        """
+        :return: str locating token i for error messages, as "line:column" where the position is known
+        """
+        position = self.position(i)
+        return "token {}".format(i) if position is None else "{0}:{1}".format(*position)
+
+    def parse_assignment(self, identifier, expr=None):
+        if expr is None:
+            raise SyntaxError("assignment to {} has no value".format(identifier[0].value))
         name = identifier[0].value
         expr = self.parse_expr(expr)
         return Assignment(name, expr)
 
     def parse_expr(self, expr, rbp=0):
         # Pratt parsing
+        start = expr.start
         left = self.nud(expr)
-        while expr and operator_precedence[(op := expr.peek().value)] > rbp:
+        while expr:
+            op = expr.peek().value
+            if op not in operator_precedence:
+                raise SyntaxError("expected an operator at {}".format(self.location(expr.start)))
+            if operator_precedence[op] <= rbp:
+                break
             next(expr)
             left = self.led(left, op, expr)
+            self.span(left, start, expr.start)
         return left
 
     def nud(self, expr, parse_func=True):
+        start = expr.start
+        node = self.parse_operand(expr, parse_func)
+        # parenthesized expressions span their brackets too
+        self.span(node, start, expr.start)
+        return node
+
+    def parse_operand(self, expr, parse_func=True):
+        if not expr:
+            raise SyntaxError("expected an expression at {}".format(self.location(expr.start)))
         token = expr.peek()
         if token.token_type is TokenType.VALUE:
             next(expr)
@@ -73,14 +136,16 @@ class Parser:
             m = parenthetical.match(expr)
             if m:
                 return self.parse_expr(m.groups)
-        else:
-            raise SyntaxError("non-value {}".format(token))
+        # returning without consuming the token would make callers loop forever
+        raise SyntaxError("non-value {0} at {1}".format(token, self.location(expr.start)))
 
     def led(self, left, op, expr):
         precedence = operator_precedence[op]
         # right associativity
         if op == "**":
             precedence -= 1
+        if op in Parser.logical_operators:
+            return Parser.logical_operators[op](left, self.parse_expr(expr, rbp=precedence))
         return BinaryOperator(
             binary_operators[op],
             left,
@@ -92,16 +157,8 @@ class Parser:
 
     def parse_if(self, expr, statements):
         root = Conditional(self.parse_expr(expr), self.parse(statements))
-        elifs = self.parse(
-            patterns={TokenSequence("elif") + parenthetical + code_block:
-                          Parser.parse_elif},
-            raise_error=False
-        )
-        else_block = self.parse(patterns={
-            TokenSequence("else") + code_block:
-                Parser.parse_else},
-            raise_error=False
-        )
+        elifs = self.parse(patterns=Parser.elif_dispatch, raise_error=False)
+        else_block = self.parse(patterns=Parser.else_dispatch, raise_error=False)
         previous = root
         for conditional in elifs + else_block:
             previous.next_node = conditional
@@ -114,13 +171,22 @@ class Parser:
     def parse_else(self, statements):
         return Conditional(ObjectLookup("true"), self.parse(statements))
 
-    def parse_func(self, name, args, statements):
+    def parse_func(self, name, args, statements=None, memo=None):
+        # groups which matched nothing are left out, so a function without arguments gets its block as args
+        if statements is None:
+            raise SyntaxError("function {} takes no arguments".format(name[0].value))
         name = name[0].value
         if args:
             args = tuple(token.value for token in args)
         else:
             args = None
-        return FuncDef(name, args, self.parse(statements))
+        return FuncDef(name, args, self.parse(statements), memo)
+
+    def parse_annotated_func(self, names, args, statements=None):
+        annotation, name = names
+        if annotation.value not in Parser.annotations:
+            raise SyntaxError("unknown annotation @{}".format(annotation.value))
+        return self.parse_func([name], args, statements, Parser.annotations[annotation.value])
 
     def parse_return(self, expr=None):
         if expr is None:
@@ -133,6 +199,15 @@ class Parser:
         TokenSequence("while") + parenthetical + code_block: parse_while,
         TokenSequence("if") + parenthetical + code_block: parse_if,
         TokenSequence("func", TokenType.IDENTIFIER) + TerminatingSequence("=") + code_block: parse_func,
+        TokenSequence("@", TokenType.IDENTIFIER, "func", TokenType.IDENTIFIER) + TerminatingSequence("=") + code_block:
+            parse_annotated_func,
         TokenSequence("return") + eof: parse_return,
         eof: parse_expr
     }
+    dispatch = DispatchTable(patterns)
+    elif_dispatch = DispatchTable({TokenSequence("elif") + parenthetical + code_block: parse_elif})
+    else_dispatch = DispatchTable({TokenSequence("else") + code_block: parse_else})
+    # values of FuncDef.memo set by annotations of form @name
+    annotations = {"memo": True, "nomemo": False}
+    # operators which short circuit, and so get their own nodes instead of a BinaryOperator
+    logical_operators = {"&&": LogicalAnd, "||": LogicalOr}
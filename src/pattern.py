@@ -1,6 +1,17 @@
 from abc import ABC, abstractmethod
-from tokens import TokenType, Token
-from stream import Stream
+from tokens import TokenType, fixed_tokens, token_codes, token_types, dynamic_codes
+
+
+def codes_of(p):
+    """
+    :param p: pre-defined token or TokenType
+    :return: set of the codes of every token p matches
+    """
+    if not isinstance(p, TokenType):
+        return {token_codes[p]}
+    elif p in dynamic_codes:
+        return {dynamic_codes[p]}
+    return {token_codes[token] for token, token_type in token_types.items() if token_type is p}
 
 
 class Match:
@@ -27,6 +38,13 @@ class Pattern(ABC):
         """
         pass
 
+    def first(self):
+        """
+        FIRST set of the pattern, used to skip patterns which cannot match the next token
+        :return: set of codes of the tokens a match can start with, or None if it can start with any token
+        """
+        return None
+
     def __add__(self, other):
         if not isinstance(other, Pattern):
             raise TypeError("cannot combine Pattern object with non-pattern")
@@ -49,13 +67,16 @@ class CombinedPattern(Pattern):
             m = pattern.match(token_stream)
             if not m:
                 if i != 0:
-                    raise SyntaxError("unable to parse expected {}".format(pattern))
+                    raise SyntaxError("unable to parse expected {0} at {1}".format(pattern, token_stream.location()))
                 return Match(False)
             matches.append(m)
         else:
             return Match(True,
                          groups=[m.groups for m in matches if m.groups])
 
+    def first(self):
+        return self.patterns[0].first()
+
     def __add__(self, other):
         if isinstance(other, CombinedPattern):
             return CombinedPattern(self.patterns + other.patterns)
@@ -73,53 +94,54 @@ class TokenSequence(Pattern):
         assert all(isinstance(p, (str, TokenType)) for p in pattern)
         self.pattern = pattern
         self.pattern_len = len(self.pattern)
+        # codes of pre-defined tokens, None where the pattern matches a TokenType instead
+        self.codes = tuple(None if isinstance(p, TokenType) else token_codes[p] for p in pattern)
 
     def match(self, token_stream):
-        groups = Stream()
+        groups = []
         try:
-            for i, p in enumerate(self.pattern):
+            for i, (p, code) in enumerate(zip(self.pattern, self.codes)):
                 token = token_stream[i]
-                if isinstance(p, TokenType) and token.token_type == p:
+                if code is None and token.token_type is p:
                     groups.append(token)
-                elif isinstance(p, str) and token == Token(p):
-                    continue
-                else:
+                elif code is None or token.code != code:
                     break
             else:
                 token_stream.consume(self.pattern_len)
                 return Match(True, groups=groups)
-        except StopIteration:
+        except IndexError:
             pass
         return Match(False)
 
+    def first(self):
+        return codes_of(self.pattern[0])
+
     def __str__(self):
         body = []
         for p in self.pattern:
             if isinstance(p, TokenType):
                 body.append(p.name.lower())
-            elif isinstance(p, Token):
-                body.append(p.value)
+            else:
+                body.append(p)
         return "sequence: {}".format(", ".join(body))
 
 
 class TerminatingSequence(Pattern):
     def __init__(self, terminator=";"):
-        self.terminator = Token(terminator)
+        self.terminator = fixed_tokens[terminator]
 
     def match(self, token_stream):
         """
         consumes tokens until a terminator is found
         :return: Match(True) (error if terminator not found)
         """
-        try:
-            for i, token in enumerate(token_stream.stream()):
-                if token == self.terminator:
-                    groups = token_stream[:i]
-                    token_stream.consume(i + 1)
-                    return Match(True, groups=groups)
-        except StopIteration:
-            raise EOFError(
-                "attempted to parse terminating sequence against stream without terminator")
+        i = token_stream.find(self.terminator.code)
+        if i is not None:
+            groups = token_stream[:i]
+            token_stream.consume(i + 1)
+            return Match(True, groups=groups)
+        raise EOFError(
+            "attempted to parse terminating sequence against stream without terminator")
 
     def __str__(self):
         return "terminator: {}".format(self.terminator)
@@ -127,33 +149,29 @@ class TerminatingSequence(Pattern):
 
 class BracketedSequence(Pattern):
     def __init__(self, open, close):
-        self.open = Token(open)
-        self.close = Token(close)
+        self.open = fixed_tokens[open]
+        self.close = fixed_tokens[close]
 
     def match(self, token_stream):
         """
-        reads tokens until there is a balanced amount of open_bracketing and closing bracket-types
+        matches a bracket together with everything up to its partner
         :param open_bracket: open_bracketing bracket-type
         :param close_bracket: closing bracket-type
         :return: the number of read tokens, the read tokens if successful, else None
         """
-        if not token_stream[0] == self.open:
+        if not token_stream or token_stream[0].code != self.open.code:
             return Match(False, groups=None)
         else:
-            level = 0
-            for i, token in enumerate(token_stream.stream()):
-                if token == self.open:
-                    level += 1
-                elif token == self.close:
-                    level -= 1
-                if not level:
-                    break
-            else:
-                raise SyntaxError("unbalanced bracketed expression detected")
+            i = token_stream.matching()
+            if i is None:
+                raise SyntaxError("unbalanced bracketed expression detected at {}".format(token_stream.location()))
             groups = token_stream[1:i]
             token_stream.consume(i + 1)
             return Match(bool(groups), groups=groups)
 
+    def first(self):
+        return {self.open.code}
+
     def __str__(self):
         return "bracketed sequence: {0}...{1}".format(self.open.value, self.close.value)
 
@@ -165,11 +183,11 @@ class DelimitedSequence(Pattern):
         :param delimiter: str delimiter- default is separator comma
         :param filter_func: filtering function for elements
         """
-        self.delimiter = Token(delimiter)
+        self.delimiter = fixed_tokens[delimiter]
         self.filter_func = filter_func
 
     def match(self, token_stream):
-        groups = Stream()
+        groups = []
         while True:
             e = token_stream.peek()
             if self.filter_func(e):
@@ -178,7 +196,7 @@ class DelimitedSequence(Pattern):
             else:
                 break
             d = token_stream.peek()
-            if d == self.delimiter:
+            if d.code == self.delimiter.code:
                 next(token_stream)
             else:
                 break
@@ -192,3 +210,25 @@ class DelimitedSequence(Pattern):
 eof = TerminatingSequence()
 parenthetical = BracketedSequence("(", ")")
 code_block = BracketedSequence("{", "}")
+
+
+class DispatchTable:
+    def __init__(self, patterns):
+        """
+        precomputes which patterns of a {pattern: func} dict can match each leading token
+        :param patterns: dict of form {pattern: func}, tried in order
+        """
+        self.patterns = patterns
+        firsts = [(pattern, func, pattern.first()) for pattern, func in patterns.items()]
+        # patterns which can start with any token are candidates for every token
+        self.default = [(pattern, func) for pattern, func, first in firsts if first is None]
+        self.table = {}
+        for code in set().union(*(first for _, _, first in firsts if first is not None)):
+            self.table[code] = [(pattern, func) for pattern, func, first in firsts
+                                if first is None or code in first]
+
+    def candidates(self, token):
+        """
+        :return: list of (pattern, func) pairs which may match a stream starting with token, in order
+        """
+        return self.table.get(token.code, self.default)
@@ -0,0 +1,510 @@
+import gc
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+from object import Func, CompiledFunc, FrameFunc
+from tree import *
+import tracing
+
+# statement classes whose exec the sampling profiler reads the running line from, Expression.exec running
+# expressions used as statements
+timed_statements = (Assignment, FuncDef, Output, Return, Conditional, While, Expression)
+
+
+class Stats:
+    __slots__ = ("count", "inclusive", "exclusive", "iterations", "active")
+
+    def __init__(self):
+        """
+        counts and times (in seconds) of a function or a source line
+        inclusive time is only added by the outermost of recursive activations, so it is not counted twice
+        """
+        self.count = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        self.iterations = 0
+        self.active = 0
+
+
+class Timer:
+    def __init__(self, clock=time.perf_counter):
+        """
+        stack of running activations, each one's exclusive time excluding the activations entered under it
+        :param clock: function returning the current time, or any other amount measured across activations
+        """
+        self.stack = []
+        self.clock = clock
+
+    def enter(self, stats):
+        stats.active += 1
+        self.stack.append([stats, self.clock(), 0.0])
+
+    def exit(self):
+        """
+        :return: exclusive time of the activation
+        """
+        stats, start, children = self.stack.pop()
+        elapsed = self.clock() - start
+        stats.count += 1
+        stats.exclusive += elapsed - children
+        stats.active -= 1
+        if not stats.active:
+            stats.inclusive += elapsed
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        return elapsed - children
+
+
+class Profiler:
+    def __init__(self):
+        """
+        deterministic profiler for the tree walker, timing every call of a coral function and every statement,
+        by its source line and column
+        the timings are taken from the events of tracing.py, whose hooks are only installed while a module runs,
+        so the profiler costs nothing when it is not running, and functions are tree walked while it runs
+        """
+        self.functions = {}
+        # Stats of every statement by statement_key
+        self.lines = {}
+        self.positions = None
+        # exclusive time of every stack of function names
+        self.stacks = Counter()
+        self.names = []
+        self.function_timer = Timer()
+        self.line_timer = Timer()
+
+    def run(self, module):
+        """
+        walks module while profiling it
+        """
+        hooks = ((tracing.STATEMENT, self.statement), (tracing.END, self.end), (tracing.ENTER, self.enter),
+                 (tracing.EXIT, self.exit), (tracing.LOOP, self.loop))
+        self.positions = module.positions
+        for event, callback in hooks:
+            tracing.register(event, callback)
+        try:
+            self.enter_function(module.name)
+            try:
+                module.walk()
+            finally:
+                self.exit_function()
+        finally:
+            for event, callback in hooks:
+                tracing.unregister(event, callback)
+
+    def enter_function(self, name):
+        if name not in self.functions:
+            self.functions[name] = Stats()
+        self.names.append(name)
+        self.function_timer.enter(self.functions[name])
+
+    def exit_function(self):
+        self.stacks[";".join(self.names)] += self.function_timer.exit()
+        self.names.pop()
+
+    def statement(self, node, namespace):
+        key = statement_key(node)
+        if key not in self.lines:
+            self.lines[key] = Stats()
+        self.line_timer.enter(self.lines[key])
+
+    def end(self, node, namespace):
+        self.line_timer.exit()
+
+    def enter(self, func, namespace):
+        self.enter_function(func.name)
+
+    def exit(self, func, namespace):
+        self.exit_function()
+
+    def loop(self, node, namespace, iteration):
+        self.lines[statement_key(node)].iterations += 1
+
+    def report(self, file=sys.stderr):
+        print_table(
+            ("function", "calls", "inclusive", "exclusive"),
+            [(name, stats.count, seconds(stats.inclusive), seconds(stats.exclusive))
+             for name, stats in sorted(self.functions.items(), key=lambda item: -item[1].exclusive)],
+            file
+        )
+        print(file=file)
+        print_table(
+            ("line", "runs", "iterations", "inclusive", "exclusive"),
+            [(statement_name(self.positions, key), stats.count, stats.iterations, seconds(stats.inclusive),
+              seconds(stats.exclusive))
+             for key, stats in sorted(self.lines.items(), key=lambda item: -item[1].exclusive)],
+            file
+        )
+
+    def write_stacks(self, file):
+        """
+        writes the exclusive time of every stack of functions in microseconds, in the collapsed stack format
+        read by flame graph tools
+        """
+        write_stacks(file, {stack: round(elapsed * 1e6) for stack, elapsed in self.stacks.items()})
+
+
+class SamplingProfiler:
+    # code objects of the methods which call a coral function, or run a statement, on the backends sampled
+    call_codes = {cls.__call__.__code__ for cls in (Func, CompiledFunc, FrameFunc)}
+    exec_codes = {cls.__dict__["exec"].__code__ for cls in timed_statements}
+    # backends whose coral calls leave no frame of a __call__ method: the vm calls functions on its own stack,
+    # and the python backend compiles them into python functions
+    unsupported = (Module.run_bytecode, Module.run_python)
+
+    def __init__(self, interval=0.005):
+        """
+        statistical profiler, which looks at the running thread's stack every interval seconds from a background
+        thread, so the profiled program runs at full speed
+        the coral functions on the stack are found from the frames of their __call__ methods, and the statement
+        from the innermost frame running a statement's exec, so it samples the walk, closure and resolved
+        backends, and statements are only known for tree walked code
+        :param interval: seconds between samples
+        """
+        self.interval = interval
+        self.samples = 0
+        # samples in which a function was anywhere on the stack, or running itself
+        self.inclusive = Counter()
+        self.exclusive = Counter()
+        # samples of every statement by statement_key
+        self.lines = Counter()
+        self.stacks = Counter()
+        # name of the module at the bottom of every stack, and positions of its tokens
+        self.root = "<module>"
+        self.positions = None
+        self.thread_id = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def run(self, module, backend=Module.walk):
+        """
+        runs module while sampling it
+        :param backend: function of form f(module) running the module, e.g. Module.run_compiled
+        """
+        if backend in self.unsupported:
+            raise ValueError("the sampling profiler cannot see the calls of {}".format(backend.__name__))
+        self.root = module.name
+        self.positions = module.positions
+        self.start()
+        try:
+            backend(module)
+        finally:
+            self.stop()
+
+    def start(self):
+        """
+        starts sampling the calling thread
+        """
+        self.thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def sample_loop(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        names = []
+        key = None, None
+        while frame is not None:
+            code = frame.f_code
+            if code in self.call_codes:
+                names.append(frame.f_locals["self"].name)
+            elif key == (None, None) and code in self.exec_codes:
+                key = statement_key(frame.f_locals["self"])
+            frame = frame.f_back
+        names.append(self.root)
+        names.reverse()
+        self.samples += 1
+        self.inclusive.update(set(names))
+        self.exclusive[names[-1]] += 1
+        self.lines[key] += 1
+        self.stacks[";".join(names)] += 1
+
+    def report(self, file=sys.stderr):
+        print("{0} samples every {1:g}ms".format(self.samples, self.interval * 1000), file=file)
+        print_table(
+            ("function", "inclusive", "exclusive"),
+            [(name, self.inclusive[name], self.exclusive[name])
+             for name in sorted(self.inclusive, key=lambda name: -self.exclusive[name])],
+            file
+        )
+        print(file=file)
+        print_table(("line", "samples"),
+                    [(statement_name(self.positions, key), n) for key, n in self.lines.most_common()], file)
+
+    def write_stacks(self, file):
+        """
+        writes the number of samples of every stack of functions, in the collapsed stack format
+        """
+        write_stacks(file, self.stacks)
+
+
+class NamespaceStats:
+    __slots__ = ("live", "peak", "bytes", "peak_bytes")
+
+    def __init__(self):
+        """
+        number and size in bytes of live local namespaces, and the most there were at once
+        """
+        self.live = 0
+        self.peak = 0
+        self.bytes = 0
+        self.peak_bytes = 0
+
+    def add(self):
+        self.live += 1
+        if self.live > self.peak:
+            self.peak = self.live
+
+    def resize(self, change):
+        self.bytes += change
+        if self.bytes > self.peak_bytes:
+            self.peak_bytes = self.bytes
+
+    def remove(self, size):
+        self.live -= 1
+        self.bytes -= size
+
+
+class MemoryProfiler:
+    # most frames tracemalloc keeps of the stack allocating a block, enough to reach the statement the block
+    # is allocated by through the python frames of the tree walker evaluating it
+    frames = 16
+
+    def __init__(self, interval=None, output=None):
+        """
+        attributes the memory traced by tracemalloc to coral functions and source lines of the tree walker, and
+        measures the live local namespaces of every function
+        the memory retained by a line is the size of the blocks still allocated that were allocated while one
+        of its statements ran, outside statements run under it, e.g. in functions it calls; tracing runs every
+        statement in a python frame located at its coral function and line, so the line is read from the
+        traceback tracemalloc keeps of each block, and a function retains what its lines retain; statements are
+        reported by line and column, but tracebacks only know lines, so what the statements of a line retain is
+        charged to the first of them to run
+        a local namespace is measured when it is created, when it calls a function, since it may have bound
+        names until then, and when its call exits, and it counts as live until it is released, so namespaces
+        kept by closures count as long as they are kept
+        the module is walked with callbacks registered through tracing, so functions are not tiered up
+        :param interval: number of statements run between snapshots written to output (None for a snapshot at
+        exit only)
+        :param output: file snapshots are written to (None to not write any)
+        """
+        self.interval = interval
+        self.output = output
+        self.functions = {}
+        # Stats of every statement by statement_key, and the key of the first statement run on every line, by
+        # (function name, line)
+        self.lines = {}
+        self.first_statements = {}
+        self.namespaces = {}
+        # all live local namespaces, of any function
+        self.total = NamespaceStats()
+        # NamespaceStats and size of every measured namespace which was not released yet, by its id
+        self.sizes = {}
+        self.statements = 0
+        self.snapshots = 0
+        # most memory traced at once while the module ran
+        self.peak = 0
+        self.root = "<module>"
+        self.positions = None
+
+    def run(self, module):
+        """
+        walks module while profiling its memory, writing a snapshot to output at exit
+        """
+        hooks = ((tracing.STATEMENT, self.statement), (tracing.CALL, self.call), (tracing.ENTER, self.enter),
+                 (tracing.EXIT, self.exit))
+        self.root = module.name
+        self.positions = module.positions
+        self.function(module.name).count += 1
+        running = tracemalloc.is_tracing()
+        if not running:
+            tracemalloc.start(self.frames)
+        for event, callback in hooks:
+            tracing.register(event, callback)
+        try:
+            module.walk()
+        finally:
+            for event, callback in hooks:
+                tracing.unregister(event, callback)
+            if self.output is not None:
+                self.snapshot(self.output)
+            self.retain()
+            self.peak = tracemalloc.get_traced_memory()[1]
+            if not running:
+                tracemalloc.stop()
+
+    def function(self, name):
+        if name not in self.functions:
+            self.functions[name] = Stats()
+        return self.functions[name]
+
+    def line(self, key):
+        if key not in self.lines:
+            self.lines[key] = Stats()
+        return self.lines[key]
+
+    def statement(self, node, namespace):
+        key = statement_key(node)
+        self.line(key).count += 1
+        if (tracing.running[-1], node.line) not in self.first_statements:
+            self.first_statements[tracing.running[-1], node.line] = key
+        self.statements += 1
+        if self.output is not None and self.interval and self.statements % self.interval == 0:
+            self.snapshot(self.output)
+
+    def call(self, node, namespace, func, args):
+        self.measure(namespace)
+
+    def enter(self, func, namespace):
+        self.function(func.name).count += 1
+        if func.name not in self.namespaces:
+            self.namespaces[func.name] = NamespaceStats()
+        stats = self.namespaces[func.name]
+        stats.add()
+        self.total.add()
+        self.sizes[id(namespace)] = stats, 0
+        self.measure(namespace)
+        weakref.finalize(namespace, self.release, id(namespace))
+
+    def exit(self, func, namespace):
+        self.measure(namespace)
+
+    def measure(self, namespace):
+        """
+        updates the size of namespace, if it is a measured local namespace
+        """
+        if id(namespace) not in self.sizes:
+            return
+        stats, size = self.sizes[id(namespace)]
+        new_size = sys.getsizeof(namespace) + sys.getsizeof(namespace.obj_dict)
+        stats.resize(new_size - size)
+        self.total.resize(new_size - size)
+        self.sizes[id(namespace)] = stats, new_size
+
+    def release(self, key):
+        stats, size = self.sizes.pop(key)
+        stats.remove(size)
+        self.total.remove(size)
+
+    def retain(self):
+        """
+        sets the memory retained by every line and function to the size of the traced blocks it allocated
+        """
+        for stats in (*self.functions.values(), *self.lines.values()):
+            stats.exclusive = 0
+        # blocks only kept by garbage reference cycles, e.g. of the frames of a raised ReturnValue, are not
+        # retained
+        gc.collect()
+        for trace in tracemalloc.take_snapshot().traces:
+            # the innermost statement is the most recent frame located at a coral line, blocks the profiler
+            # allocates in its callbacks are not the program's
+            for frame in reversed(trace.traceback):
+                if frame.filename == __file__:
+                    break
+                location = frame.filename, frame.lineno or None
+                if location in tracing.located:
+                    self.function(frame.filename).exclusive += trace.size
+                    self.line(self.first_statements[location]).exclusive += trace.size
+                    break
+
+    def snapshot(self, file):
+        """
+        writes the measurements so far, one record per line in a fixed order, so that snapshots of different
+        runs can be compared with diff
+        """
+        self.retain()
+        self.snapshots += 1
+        current, peak = tracemalloc.get_traced_memory()
+        print("snapshot {0} after {1} statements".format(self.snapshots, self.statements), file=file)
+        print("traced current={0} peak={1}".format(current, peak), file=file)
+        print("namespaces live={0} peak={1} bytes={2} peak_bytes={3}".format(
+            self.total.live, self.total.peak, self.total.bytes, self.total.peak_bytes), file=file)
+        for name in sorted(self.functions, key=lambda name: (name != self.root, name)):
+            stats = self.functions[name]
+            namespaces = self.namespaces.get(name, NamespaceStats())
+            print("function {0} calls={1} retained={2} namespaces={3} peak_namespaces={4} namespace_bytes={5} "
+                  "peak_namespace_bytes={6}".format(name, stats.count, stats.exclusive, namespaces.live,
+                                                    namespaces.peak, namespaces.bytes, namespaces.peak_bytes),
+                  file=file)
+        for key in sorted(self.lines, key=statement_order):
+            stats = self.lines[key]
+            print("line {0} runs={1} retained={2}".format(statement_name(self.positions, key), stats.count,
+                                                          stats.exclusive), file=file)
+
+    def report(self, file=sys.stderr):
+        """
+        prints the measurements, the functions and lines retaining the most memory first
+        """
+        print("peak traced {} bytes".format(self.peak), file=file)
+        print("peak namespaces {0} of {1} bytes".format(self.total.peak, self.total.peak_bytes), file=file)
+        rows = []
+        for name, stats in sorted(self.functions.items(), key=lambda item: -item[1].exclusive):
+            namespaces = self.namespaces.get(name, NamespaceStats())
+            rows.append((name, stats.count, stats.exclusive, namespaces.live, namespaces.peak,
+                         namespaces.peak_bytes))
+        print_table(("function", "calls", "retained", "namespaces", "peak namespaces", "peak namespace bytes"),
+                    rows, file)
+        print(file=file)
+        print_table(
+            ("line", "runs", "retained"),
+            [(statement_name(self.positions, key), stats.count, stats.exclusive)
+             for key, stats in sorted(self.lines.items(), key=lambda item: -item[1].exclusive)],
+            file
+        )
+
+
+def statement_key(node):
+    """
+    :return: (line, start) identifying the statement node in the profiles, start being the index of its first
+    token, either of which may be None
+    """
+    return node.line, node.start
+
+
+def statement_order(key):
+    line, start = key
+    return line is None, line or 0, start is None, start or 0
+
+
+def statement_name(positions, key):
+    """
+    :param positions: tokens.Positions of the module the statement is in (None if unknown)
+    :return: "line:column" of the statement of key where its position is known, else its line
+    """
+    line, start = key
+    if positions is not None and start is not None and start < len(positions):
+        return positions.location(start)
+    return line_name(line)
+
+
+def line_name(line):
+    return "?" if line is None else str(line)
+
+
+def seconds(elapsed):
+    return "{:.6f}s".format(elapsed)
+
+
+def print_table(header, rows, file):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    for row in (header, *rows):
+        print("  ".join(str(cell).ljust(width) if i == 0 else str(cell).rjust(width)
+                        for i, (cell, width) in enumerate(zip(row, widths))), file=file)
+
+
+def write_stacks(file, counts):
+    for stack, n in sorted(counts.items()):
+        if n:
+            print(stack, n, file=file)
@@ -0,0 +1,247 @@
+import ast
+import keyword
+from tree import *
+from tokens import operator_symbols
+from resolver import Scope
+from object import MemoFunc
+
+native_operators = {
+    "+": ast.Add,
+    "-": ast.Sub,
+    "*": ast.Mult,
+    "/": ast.Div,
+    "**": ast.Pow,
+    "@": ast.MatMult,
+    "%": ast.Mod,
+    ">>": ast.RShift,
+    "<<": ast.LShift,
+    "&": ast.BitAnd,
+    "|": ast.BitOr,
+    "^": ast.BitXor,
+}
+
+native_comparisons = {
+    ">": ast.Gt,
+    "<": ast.Lt,
+    "===": ast.Is,
+    "!==": ast.IsNot,
+    "==": ast.Eq,
+    "!=": ast.NotEq,
+    ">=": ast.GtE,
+    "<=": ast.LtE,
+    ":>": ast.In,
+}
+
+# coral identifiers are ascii, so names starting with a non-ascii character can never collide with them
+UNBOUND = "λunbound"
+PRINT = "λprint"
+
+
+def global_name(name):
+    return "λ" + name if keyword.iskeyword(name) else name
+
+
+def mangle(scope, name):
+    """
+    :return: name of the python variable holding a coral name bound in scope
+    """
+    if scope.parent is None:
+        return global_name(name)
+    return "λ{0}_{1}".format(scope.depth, name)
+
+
+class PythonCompiler:
+    """
+    lowers a Module into a python ast which is compiled to CPython bytecode
+
+    coral functions become python functions and every coral namespace becomes a python scope
+    a coral lookup falls back to enclosing namespaces while a local is still unbound, so reads
+    which cannot be proven to hit an assigned local compile to a chain of checks against UNBOUND
+    """
+    def __init__(self):
+        self.scope = None
+        self.constants = {}
+
+    def compile_module(self, module, filename="<coral>"):
+        """
+        :param module: Module object to compile
+        :return: function of form f(namespace) which runs the module in the given namespace
+        """
+        tree = self.lower_module(module)
+        code = compile(tree, filename=filename, mode="exec")
+        constants = dict(self.constants, **{UNBOUND: object(), PRINT: print})
+
+        def run(namespace):
+            # the constants are the globals, and the namespace is both the module's locals, which it stores to,
+            # and the builtins, which functions fall back to after the globals, so it holds only coral names
+            obj_dict = namespace.obj_dict
+            exec(code, dict(constants, __builtins__=obj_dict), obj_dict)
+        return run
+
+    def lower_module(self, module):
+        self.scope = Scope()
+        tree = ast.Module(body=self.lower_block(module.nodes), type_ignores=[])
+        return ast.fix_missing_locations(tree)
+
+    def source(self, module):
+        """
+        :return: python source equivalent to the module, for inspection
+        """
+        return ast.unparse(self.lower_module(module))
+
+    def constant(self, value):
+        """
+        makes an arbitrary python object available to the compiled code
+        :return: ast node loading the object
+        """
+        name = "λconst{}".format(id(value))
+        self.constants[name] = value
+        return ast.Name(id=name, ctx=ast.Load())
+
+    def lower_block(self, statements):
+        body = []
+        for statement in statements:
+            lowered = self.lower_statement(statement)
+            if isinstance(lowered, list):
+                body.extend(lowered)
+            else:
+                body.append(lowered)
+        return body or [ast.Pass()]
+
+    def lower_statement(self, node):
+        if isinstance(node, Expression):
+            return ast.Expr(value=self.lower(node))
+        elif isinstance(node, Statement):
+            return self.lower(node)
+        else:
+            raise TypeError
+
+    def lower(self, node):
+        handler = self.handlers.get(type(node))
+        if handler is None:
+            raise TypeError("cannot compile {} to python".format(type(node).__name__))
+        return handler(self, node)
+
+    def load(self, name):
+        """
+        builds the expression reading a coral name from the current scope
+        """
+        candidates = [mangle(scope, name) for scope in self.scope.resolve(name)]
+        expr = ast.Name(id=candidates.pop(), ctx=ast.Load())
+        for candidate in reversed(candidates):
+            expr = ast.IfExp(
+                test=ast.Compare(left=ast.Name(id=candidate, ctx=ast.Load()), ops=[ast.IsNot()],
+                                 comparators=[ast.Name(id=UNBOUND, ctx=ast.Load())]),
+                body=ast.Name(id=candidate, ctx=ast.Load()),
+                orelse=expr
+            )
+        return expr
+
+    def store(self, name):
+        self.scope.bind(name)
+        return ast.Name(id=mangle(self.scope, name), ctx=ast.Store())
+
+    def lower_branch(self, statements):
+        restore = self.scope.branch()
+        body = self.lower_block(statements)
+        restore()
+        return body
+
+    def lower_assignment(self, node):
+        value = self.lower(node.value)
+        return ast.Assign(targets=[self.store(node.name)], value=value)
+
+    def lower_func_def(self, node):
+        args = node.args or ()
+        outer = self.scope
+        self.scope = scope = Scope(parent=outer, args=args, statements=node.statements)
+        body = self.lower_block(node.statements)
+        self.scope = outer
+        body = [
+            ast.Assign(targets=[ast.Name(id=mangle(scope, name), ctx=ast.Store())],
+                       value=ast.Name(id=UNBOUND, ctx=ast.Load()))
+            for name in sorted(scope.checked)
+        ] + body
+        target = self.store(node.name)
+        func = ast.FunctionDef(
+            name=target.id,
+            args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=mangle(scope, arg)) for arg in args],
+                               kwonlyargs=[], kw_defaults=[], defaults=[]),
+            body=body,
+            decorator_list=[self.constant(MemoFunc)] if node.memo else []
+        )
+        if target.id == node.name:
+            return func
+        # keep the coral name in error messages, e.g. on arity mismatches
+        rename = ast.Assign(
+            targets=[ast.Attribute(value=ast.Name(id=target.id, ctx=ast.Load()), attr="__name__",
+                                   ctx=ast.Store())],
+            value=ast.Constant(value=node.name)
+        )
+        return [func, rename]
+
+    def lower_output(self, node):
+        return ast.Expr(value=ast.Call(func=ast.Name(id=PRINT, ctx=ast.Load()),
+                                       args=[self.lower(node.expression)], keywords=[]))
+
+    def lower_return(self, node):
+        if self.scope.parent is None:
+            raise SyntaxError("'return' outside function")
+        return ast.Return(value=self.lower(node.expr))
+
+    def lower_conditional(self, node):
+        test = self.lower(node.condition)
+        body = self.lower_branch(node.statements)
+        orelse = [] if node.next_node is None else [self.lower(node.next_node)]
+        return ast.If(test=test, body=body, orelse=orelse)
+
+    def lower_while(self, node):
+        test = self.lower(node.condition)
+        return ast.While(test=test, body=self.lower_branch(node.statements), orelse=[])
+
+    def lower_unbind(self, node):
+        for name in node.names:
+            self.scope.definite.discard(name)
+        return ast.Delete(targets=[ast.Name(id=mangle(self.scope, name), ctx=ast.Del()) for name in node.names])
+
+    def lower_call(self, node):
+        return ast.Call(func=self.load(node.func_name),
+                        args=[self.lower(arg) for arg in node.arg_vals], keywords=[])
+
+    def lower_object_lookup(self, node):
+        return self.load(node.name)
+
+    def lower_value(self, node):
+        return ast.Constant(value=node.value)
+
+    def lower_binary_operator(self, node):
+        symbol = operator_symbols.get(node.func)
+        left, right = self.lower(node.left), self.lower(node.right)
+        if symbol in native_operators:
+            return ast.BinOp(left=left, op=native_operators[symbol](), right=right)
+        elif symbol in native_comparisons:
+            return ast.Compare(left=left, ops=[native_comparisons[symbol]()], comparators=[right])
+        else:
+            return ast.Call(func=self.constant(node.func), args=[left, right], keywords=[])
+
+    def lower_logical_and(self, node):
+        return ast.BoolOp(op=ast.And(), values=[self.lower(node.left), self.lower(node.right)])
+
+    def lower_logical_or(self, node):
+        return ast.BoolOp(op=ast.Or(), values=[self.lower(node.left), self.lower(node.right)])
+
+    handlers = {
+        Assignment: lower_assignment,
+        FuncDef: lower_func_def,
+        Output: lower_output,
+        Return: lower_return,
+        Conditional: lower_conditional,
+        While: lower_while,
+        Unbind: lower_unbind,
+        Call: lower_call,
+        ObjectLookup: lower_object_lookup,
+        Value: lower_value,
+        BinaryOperator: lower_binary_operator,
+        LogicalAnd: lower_logical_and,
+        LogicalOr: lower_logical_or
+    }
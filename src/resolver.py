@@ -0,0 +1,203 @@
+from tree import *
+from namespace import Frame, UNBOUND
+
+
+def assigned_names(statements):
+    """
+    collects the names a block binds in its own scope (function bodies are not descended into)
+    """
+    names = set()
+    for statement in statements:
+        if isinstance(statement, (Assignment, FuncDef)):
+            names.add(statement.name)
+        elif isinstance(statement, ControlFlowElement):
+            while statement is not None:
+                names |= assigned_names(statement.statements)
+                statement = getattr(statement, "next_node", None)
+    return names
+
+
+class Scope:
+    def __init__(self, parent=None, args=(), statements=(), names=()):
+        """
+        static view of a coral namespace
+        :param parent: enclosing Scope (None for the module)
+        :param args: names of function parameters, which take the first slots
+        :param statements: body of the function (or module)
+        :param names: any further names known to be bound in the scope, e.g. builtins
+        """
+        if len(set(args)) != len(args):
+            raise SyntaxError("duplicate argument in function definition")
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.slots = {name: i for i, name in enumerate(args)}
+        for name in sorted((assigned_names(statements) | set(names)) - set(args)):
+            self.slots[name] = len(self.slots)
+        self.locals = set(self.slots)
+        # names which are certainly bound at the point currently being compiled
+        self.definite = set(args)
+        # names of the parent which were certainly bound when this function was defined
+        self.outer_definite = set() if parent is None else set(parent.definite)
+        # locals which are read before they are certainly bound
+        self.checked = set()
+
+    def resolve(self, name):
+        """
+        finds the scopes a read of name may be served from at the point currently being compiled
+        a coral lookup falls back to enclosing namespaces while a local is still unbound, so every scope
+        binding name is a candidate until one which certainly holds it is reached
+        :return: list of candidate Scope objects from innermost outwards, always ending with the module
+            unless a function scope certainly holds name
+        """
+        scopes = []
+        scope, definite = self, self.definite
+        while scope.parent is not None:
+            if name in scope.locals:
+                scopes.append(scope)
+                if name in definite:
+                    return scopes
+                scope.checked.add(name)
+            definite = scope.outer_definite
+            scope = scope.parent
+        scopes.append(scope)
+        return scopes
+
+    def bind(self, name):
+        self.definite.add(name)
+
+    def branch(self):
+        """
+        :return: function restoring the set of certainly bound names, as bindings made inside a branch
+            are not certain once it is left
+        """
+        definite = set(self.definite)
+
+        def restore():
+            self.definite = definite
+        return restore
+
+
+class Resolver:
+    """
+    rewrites a Module so that every name is addressed by (depth, slot) instead of being looked up by
+    name in a chain of Namespace objects
+    the rewritten nodes run on Frame objects, whose slots are plain lists
+    """
+    def __init__(self):
+        self.scope = None
+
+    def compile_module(self, module):
+        """
+        :param module: Module object to resolve
+        :return: function of form f(namespace) walking the resolved module in a frame mirroring namespace
+        """
+        names = tuple(module.namespace.obj_dict)
+        nodes = self.resolve(module, names)
+        slots = self.scope.slots
+
+        def run(namespace):
+            obj_dict = namespace.obj_dict
+            frame = Frame(None, [obj_dict.get(name, UNBOUND) for name in slots])
+            try:
+                for node in nodes:
+                    node.exec(frame)
+            finally:
+                # keep the namespace in sync so the module can still be inspected and run by other backends
+                obj_dict.update((name, frame.slots[i]) for name, i in slots.items()
+                                if frame.slots[i] is not UNBOUND)
+        return run
+
+    def resolve(self, module, names=()):
+        """
+        :param names: names already bound in the module's namespace
+        :return: list of resolved nodes
+        """
+        self.scope = Scope(statements=module.nodes, names=names)
+        return self.resolve_block(module.nodes)
+
+    def resolve_block(self, statements):
+        return [self.resolve_node(statement) for statement in statements]
+
+    def resolve_branch(self, statements):
+        restore = self.scope.branch()
+        statements = self.resolve_block(statements)
+        restore()
+        return statements
+
+    def resolve_node(self, node):
+        handler = self.handlers.get(type(node))
+        if handler is None:
+            return node
+        # resolved nodes are walked, so errors raised by them are located like those of the nodes they replace
+        return handler(self, node).locate(node)
+
+    def lookup(self, name):
+        addresses = tuple((scope.depth, scope.slots[name]) for scope in self.scope.resolve(name)
+                          if name in scope.slots)
+        if len(addresses) == 1:
+            depth, slot = addresses[0]
+            if depth == self.scope.depth:
+                return LocalLookup(name, depth, slot)
+            return SlotLookup(name, depth, slot)
+        return FallbackLookup(name, addresses)
+
+    def resolve_assignment(self, node):
+        value = self.resolve_node(node.value)
+        self.scope.bind(node.name)
+        return SlotAssignment(node.name, self.scope.slots[node.name], value)
+
+    def resolve_func_def(self, node):
+        args = node.args or ()
+        outer, self.scope = self.scope, Scope(parent=self.scope, args=args, statements=node.statements)
+        statements = self.resolve_block(node.statements)
+        size = len(self.scope.slots)
+        self.scope = outer
+        self.scope.bind(node.name)
+        return SlotFuncDef(node.name, self.scope.slots[node.name], args, statements, size, node.memo)
+
+    def resolve_output(self, node):
+        return Output(self.resolve_node(node.expression))
+
+    def resolve_return(self, node):
+        return Return(self.resolve_node(node.expr))
+
+    def resolve_conditional(self, node):
+        condition = self.resolve_node(node.condition)
+        statements = self.resolve_branch(node.statements)
+        next_node = None if node.next_node is None else self.resolve_node(node.next_node)
+        return Conditional(condition, statements, next_node)
+
+    def resolve_while(self, node):
+        return While(self.resolve_node(node.condition), self.resolve_branch(node.statements))
+
+    def resolve_unbind(self, node):
+        for name in node.names:
+            self.scope.definite.discard(name)
+        return SlotUnbind(node.names, tuple(self.scope.slots[name] for name in node.names))
+
+    def resolve_call(self, node):
+        return SlotCall(self.lookup(node.func_name), [self.resolve_node(arg) for arg in node.arg_vals])
+
+    def resolve_object_lookup(self, node):
+        return self.lookup(node.name)
+
+    def resolve_binary_operator(self, node):
+        return BinaryOperator(node.func, self.resolve_node(node.left), self.resolve_node(node.right))
+
+    def resolve_logical_operator(self, node):
+        return type(node)(self.resolve_node(node.left), self.resolve_node(node.right))
+
+    handlers = {
+        Assignment: resolve_assignment,
+        FuncDef: resolve_func_def,
+        Output: resolve_output,
+        Return: resolve_return,
+        Conditional: resolve_conditional,
+        While: resolve_while,
+        Unbind: resolve_unbind,
+        Call: resolve_call,
+        ObjectLookup: resolve_object_lookup,
+        BinaryOperator: resolve_binary_operator,
+        LogicalAnd: resolve_logical_operator,
+        LogicalOr: resolve_logical_operator
+    }
@@ -1,28 +1,59 @@
-from more_itertools import peekable
+from tokens import TERMINATOR_CODE, TokenBuffer, bracket_pairs, location
 
 
-class Stream(peekable):
-    def __init__(self, iterable=None):
+class Stream:
+    __slots__ = ("tokens", "start", "end")
+
+    def __init__(self, tokens=None, start=0, end=None):
+        """
+        view over tokens[start:end] which is consumed from the front
+        slicing a stream gives another view over the same tokens, so no tokens are ever copied
+        :param tokens: sequence with O(1) indexing (e.g. a TokenBuffer), other iterables are read into a list
+        :param start: index of the first token in the view
+        :param end: index after the last token in the view (None for the end of tokens)
+        """
+        if tokens is None:
+            tokens = []
+        elif not hasattr(tokens, "__getitem__"):
+            tokens = list(tokens)
+        self.tokens = tokens
+        self.start = start
+        self.end = len(tokens) if end is None else end
+
+    def __bool__(self):
+        return self.start < self.end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.start >= self.end:
+            raise StopIteration
+        self.start += 1
+        return self.tokens[self.start - 1]
+
+    def peek(self, *default):
         """
-        subclass for peekable providing several helper methods
-        :param iterator: base iterator
+        get the next element without consuming it
+        :param default: returned instead of raising StopIteration if the stream is empty
         """
-        if iterable is None:
-            iterable = []
-        super().__init__(iterable)
+        if self.start < self.end:
+            return self.tokens[self.start]
+        elif default:
+            return default[0]
+        raise StopIteration
 
     def stream(self):
         """
         allows for iteration without consuming tokens
         :yield: sequential tokens
         """
-        i = 0
-        while True:
-            try:
-                yield self[i]
-            except IndexError:
-                raise StopIteration
-            i += 1
+        tokens = self.tokens
+        for i in range(self.start, self.end):
+            yield tokens[i]
 
     def consume(self, n=None):
         """
@@ -30,26 +61,70 @@ class Stream(peekable):
         :param n: number of elements to consume (if None consume all)
         :return: True if there were n elements left to consume
         """
-        try:
-            for i in range(n):
-                next(self)
-        except StopIteration:
-            return False
-        else:
-            return True
-
-    def append(self, item):
-        self._cache.append(item)
+        if n is None:
+            n = len(self)
+        enough = n <= len(self)
+        self.start = min(self.start + n, self.end)
+        return enough
 
-    def extend(self, *items):
-        self._cache.extend(items)
+    def location(self):
+        """
+        :return: str locating the front of the stream for error messages, as "line:column" for streams over a
+        TokenBuffer, else by token index
+        """
+        if isinstance(self.tokens, TokenBuffer) and self.start < len(self.tokens):
+            return location(self.tokens.line_starts, self.tokens.offsets[self.start])
+        return "token {}".format(self.start)
 
     def __str__(self):
-
-        return "<Stream object> {{\n    {}\n}}".format(",\n    ".join((map(str, self[:]))))
+        return "<Stream object> {{\n    {}\n}}".format(",\n    ".join(map(str, self.stream())))
 
     def __getitem__(self, item):
-        e = super().__getitem__(item)
-        if isinstance(e, list):
-            e = Stream(e)
-        return e
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                raise ValueError("streams can only be sliced contiguously")
+            return Stream(self.tokens, self.start + start, self.start + max(start, stop))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("stream index out of range")
+        return self.tokens[self.start + item]
+
+    def find(self, code):
+        """
+        finds the next token with the given code
+        the next terminator of a TokenBuffer is looked up in its side table instead of scanning
+        :param code: token code to look for
+        :return: index of the token in the stream, or None if the stream does not hold one
+        """
+        terminators = getattr(self.tokens, "terminators", None)
+        if code == TERMINATOR_CODE and terminators is not None and self:
+            i = terminators[self.start]
+        else:
+            i = next((i for i in range(self.start, self.end) if self.tokens[i].code == code), self.end)
+        return i - self.start if i < self.end else None
+
+    def matching(self, i=0):
+        """
+        finds the bracket closing the one at index i
+        the partner is looked up in a TokenBuffer's side table instead of scanning
+        :param i: index of an opening bracket in the stream
+        :return: index of its partner in the stream, or None if the partner is not in the stream
+        """
+        i += self.start
+        partners = getattr(self.tokens, "partners", None)
+        if partners is not None:
+            j = partners[i]
+            return j - self.start if i < j < self.end else None
+        open_code = self.tokens[i].code
+        close_code, level = bracket_pairs[open_code], 0
+        for j in range(i, self.end):
+            code = self.tokens[j].code
+            if code == open_code:
+                level += 1
+            elif code == close_code:
+                level -= 1
+                if not level:
+                    return j - self.start
+        return None
@@ -1,3 +1,5 @@
+from array import array
+from bisect import bisect_right
 from enum import Enum
 import string
 import operator as op
@@ -30,8 +32,10 @@ binary_operators = {
     "^^": lambda a, b: bool(a) != bool(b),
     ":>": lambda a, b: a in b,
 }
+operator_symbols = {func: symbol for symbol, func in binary_operators.items()}
 
 # rbp is set to multiples of 10 to support right associativity during parsing
+# precedences start at 10, as operators only bind if their precedence exceeds the initial rbp of 0
 operator_precedence = {op: i * 10 for i, ops in enumerate((
     ("||",),
     ("^^",),
@@ -44,7 +48,7 @@ operator_precedence = {op: i * 10 for i, ops in enumerate((
     ("+", "-"),
     ("*", "/", "@", "%"),
     ("**",),
-)) for op in ops}
+), 1) for op in ops}
 
 
 class TokenType(Enum):
@@ -60,11 +64,14 @@ class TokenType(Enum):
 
 
 class Token:
+    __slots__ = ("token_type", "value", "code")
+
     def __init__(self, value, token_type=None, node_type=None):
         if token_type is None:
             token_type = token_types[value]
         self.token_type = token_type
         self.value = value
+        self.code = dynamic_codes[token_type] if token_type in dynamic_codes else token_codes[value]
 
     def __str__(self):
         string = f"{self.token_type}: {self.value}"
@@ -73,13 +80,177 @@ class Token:
     def __eq__(self, other):
         if isinstance(other, Token):
             return (
-                    self.token_type == other.token_type and
+                    self.code == other.code and
                     self.value == other.value
             )
         else:
             return False
 
 
+class TokenBuffer:
+    def __init__(self):
+        """
+        compact storage for a lexed token stream, holding the tokens as parallel arrays
+        codes holds the code of every token, and values the index of its value in self.literals
+        pre-defined tokens are fully described by their code, identifiers and values share one entry of
+        self.literals for every distinct value
+        partners maps every bracket to the index of its partner, and terminators maps every index to
+        the index of the next ";" (or len(self) if there is none), so patterns can jump instead of scanning
+        offsets holds the position of every token in the source, and line_starts the position of the first
+        character of every line, which the lexer fills in, so lines and columns are only worked out (by bisecting
+        line_starts) when they are asked for
+        """
+        self.codes = array("B")
+        self.values = array("I")
+        self.offsets = array("Q")
+        self.line_starts = array("Q", [0])
+        self.literals = []
+        self.literal_indices = {}
+        self.partners = array("I")
+        self.terminators = array("I")
+        # (index, offset) of every bracket which has not been closed yet
+        self.open_brackets = []
+        # index of the first token whose next terminator has not been seen yet
+        self.unterminated = 0
+
+    def append(self, code, value=None, offset=0):
+        """
+        :param code: code of the token
+        :param value: value of identifiers and values
+        :param offset: position of the token in the source
+        """
+        i = len(self.codes)
+        self.partners.append(0)
+        self.terminators.append(0)
+        if code in bracket_pairs:
+            self.open_brackets.append((i, offset))
+        elif code in closing_brackets:
+            if not self.open_brackets:
+                raise SyntaxError("unbalanced brackets: '{0}' at {1} does not close anything".format(
+                    code_tokens[code].value, location(self.line_starts, offset)))
+            opening, opening_offset = self.open_brackets.pop()
+            if bracket_pairs[self.codes[opening]] != code:
+                raise SyntaxError("unbalanced brackets: '{0}' at {1} does not close '{2}' at {3}".format(
+                    code_tokens[code].value, location(self.line_starts, offset),
+                    code_tokens[self.codes[opening]].value, location(self.line_starts, opening_offset)))
+            self.partners[opening] = i
+            self.partners[i] = opening
+        elif code == TERMINATOR_CODE:
+            for j in range(self.unterminated, i + 1):
+                self.terminators[j] = i
+            self.unterminated = i + 1
+        index = 0
+        if code >= IDENTIFIER_CODE:
+            # type is part of the key so that e.g. 1 and 1.0 stay distinct
+            key = (type(value), value)
+            index = self.literal_indices.get(key)
+            if index is None:
+                index = self.literal_indices[key] = len(self.literals)
+                self.literals.append(value)
+        self.codes.append(code)
+        self.values.append(index)
+        self.offsets.append(offset)
+
+    def finish(self):
+        """
+        called once every token has been appended
+        :return: self
+        """
+        if self.open_brackets:
+            opening, offset = self.open_brackets[0]
+            raise SyntaxError("unbalanced brackets: '{0}' at {1} is never closed".format(
+                code_tokens[self.codes[opening]].value, location(self.line_starts, offset)))
+        for j in range(self.unterminated, len(self.codes)):
+            self.terminators[j] = len(self.codes)
+        self.unterminated = len(self.codes)
+        return self
+
+    def end(self, i):
+        """
+        :return: position in the source just after token i, which must be a pre-defined token
+        """
+        return self.offsets[i] + len(code_tokens[self.codes[i]].value)
+
+    def line(self, i):
+        """
+        :return: number (from 1) of the line token i starts on
+        """
+        return bisect_right(self.line_starts, self.offsets[i])
+
+    def position(self, i):
+        """
+        :return: (line, column) of the start of token i, both counted from 1
+        """
+        return position(self.line_starts, self.offsets[i])
+
+    def positions(self):
+        """
+        :return: Positions of the tokens, sharing the arrays of self
+        """
+        return Positions(self.offsets, self.line_starts)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        """
+        :return: the interned Token for pre-defined tokens, else a new Token built from the arrays
+        """
+        code = self.codes[i]
+        if code < IDENTIFIER_CODE:
+            return code_tokens[code]
+        return Token(self.literals[self.values[i]], token_type=code_types[code])
+
+    def __iter__(self):
+        for i in range(len(self.codes)):
+            yield self[i]
+
+
+class Positions:
+    __slots__ = ("offsets", "line_starts")
+
+    def __init__(self, offsets, line_starts):
+        """
+        the part of a TokenBuffer kept by a parsed Module, so that the start and end token indices of its nodes
+        can be mapped to lines and columns
+        :param offsets: array of the position in the source of every token
+        :param line_starts: array of the position of the first character of every line, starting with 0
+        """
+        self.offsets = offsets
+        self.line_starts = line_starts
+
+    def position(self, i):
+        """
+        :return: (line, column) of the start of token i, both counted from 1
+        """
+        return position(self.line_starts, self.offsets[i])
+
+    def location(self, i):
+        """
+        :return: str of form "line:column" locating token i
+        """
+        return location(self.line_starts, self.offsets[i])
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def position(line_starts, offset):
+    """
+    :param line_starts: sorted positions of the first character of every line, starting with 0
+    :return: (line, column) of the position offset in the source, both counted from 1
+    """
+    line = bisect_right(line_starts, offset)
+    return line, offset - line_starts[line - 1] + 1
+
+
+def location(line_starts, offset):
+    """
+    :return: str of form "line:column" locating offset, for error messages
+    """
+    return "{0}:{1}".format(*position(line_starts, offset))
+
+
 # token types initialization
 token_types = {
     token: token_type for token_type, tokens in (
@@ -93,3 +264,17 @@ token_types = {
         (TokenType.SEPARATOR, (" ", ","))
     ) for token in tokens
 }
+
+# every pre-defined token has its own code, so comparing against one is a single integer compare
+token_codes = {token: code for code, token in enumerate(token_types)}
+IDENTIFIER_CODE = len(token_codes)
+VALUE_CODE = IDENTIFIER_CODE + 1
+dynamic_codes = {TokenType.IDENTIFIER: IDENTIFIER_CODE, TokenType.VALUE: VALUE_CODE}
+code_types = {code: token_type for token_type, code in dynamic_codes.items()}
+bracket_pairs = {token_codes["("]: token_codes[")"], token_codes["{"]: token_codes["}"]}
+closing_brackets = {close: opening for opening, close in bracket_pairs.items()}
+TERMINATOR_CODE = token_codes[";"]
+
+# interned instances of every pre-defined token
+fixed_tokens = {token: Token(token, token_type) for token, token_type in token_types.items()}
+code_tokens = tuple(fixed_tokens.values())
@@ -0,0 +1,199 @@
+"""
+hooks called as the tree walker runs a module, for tools such as coverage, debuggers and line counters
+
+    import tracing
+    tracing.register(tracing.STATEMENT, lambda node, namespace: print(node.line))
+
+callbacks receive the node the event happened on, and the namespace it ran in:
+STATEMENT   f(node, namespace)            before a statement runs
+END         f(node, namespace)            after a statement ran, also when it raised, e.g. to return
+EXPRESSION  f(node, namespace, value)     after an expression used as a statement, the condition of an if, elif
+                                          or while, or an argument of a call was evaluated
+CALL        f(node, namespace, func, args)    before a Call node calls func
+ENTER       f(func, namespace)            before a function runs its statements, in the new local namespace of
+                                          the call
+EXIT        f(func, namespace)            after a function's statements stopped running, by returning, raising or
+                                          running to their end
+RETURN      f(node, namespace, func, value)   after func returned normally to a Call node
+LOOP        f(node, namespace, iteration)     before every iteration of a While node, counted from 1
+
+the node classes run uninstrumented methods while no callback is registered: the first registration replaces
+Module.walk, the exec methods of blocks, Call.eval and Func.__call__ at class level with ones emitting
+events, and removing the last callback puts the originals back
+functions are always tree walked while tracing, rather than run through closures compiled by the jit, so
+their statements emit events too
+every statement runs in a python frame whose file is named after the coral function it is in (or the module)
+and whose line is its coral line, so python tools looking at frames, such as tracemalloc and tracebacks, see
+where in the coral source it runs
+"""
+from types import CodeType, FunctionType
+from object import Func
+from tree import *
+
+STATEMENT = "statement"
+END = "end"
+EXPRESSION = "expression"
+CALL = "call"
+ENTER = "enter"
+EXIT = "exit"
+RETURN = "return"
+LOOP = "loop"
+events = (STATEMENT, END, EXPRESSION, CALL, ENTER, EXIT, RETURN, LOOP)
+
+# callbacks registered for every event, in the order they were registered
+callbacks = {event: [] for event in events}
+# methods replaced while any callback is registered, of form {(class, name): original}
+originals = {}
+# names of the coral functions running, innermost last, the module's name first
+running = []
+# code of the function a statement runs in, kept on one line so that it can be moved to any line as a whole
+located_code = next(const for const in compile("def statement(node, namespace): execute(node, namespace)",
+                                               "<coral>", "exec").co_consts if isinstance(const, CodeType))
+# functions of form f(node, namespace) running a statement located at a line of a coral function, by
+# (function name, line)
+located = {}
+
+
+def register(event, callback):
+    if event not in callbacks:
+        raise ValueError("unknown event {}".format(event))
+    callbacks[event].append(callback)
+    if not originals:
+        install()
+
+
+def unregister(event, callback):
+    """
+    removes a callback registered for event, raising ValueError if it is not registered
+    """
+    if event not in callbacks:
+        raise ValueError("unknown event {}".format(event))
+    callbacks[event].remove(callback)
+    if not any(callbacks.values()):
+        uninstall()
+
+
+def clear():
+    """
+    removes every callback
+    """
+    for registered in callbacks.values():
+        registered.clear()
+    uninstall()
+
+
+def install():
+    for (cls, name), method in instrumented.items():
+        originals[cls, name] = cls.__dict__[name]
+        setattr(cls, name, method)
+
+
+def uninstall():
+    for (cls, name), method in originals.items():
+        setattr(cls, name, method)
+    originals.clear()
+
+
+def run_block(statements, namespace):
+    for statement in statements:
+        for callback in callbacks[STATEMENT]:
+            callback(statement, namespace)
+        try:
+            location(running[-1], statement.line)(statement, namespace)
+        finally:
+            for callback in callbacks[END]:
+                callback(statement, namespace)
+
+
+def execute(statement, namespace):
+    if isinstance(statement, Expression):
+        evaluate(statement, namespace)
+    else:
+        statement.exec(namespace)
+
+
+def location(name, line):
+    """
+    :return: function running a statement like execute, in a frame located at line of the coral function name
+    """
+    if (name, line) not in located:
+        code = located_code.replace(co_filename=name, co_firstlineno=line or 0)
+        located[name, line] = FunctionType(code, globals())
+    return located[name, line]
+
+
+def evaluate(node, namespace):
+    value = node.eval(namespace)
+    for callback in callbacks[EXPRESSION]:
+        callback(node, namespace, value)
+    return value
+
+
+def walk(self):
+    running.append(self.name)
+    try:
+        for node in self.nodes:
+            if not isinstance(node, (Statement, Expression)):
+                raise TypeError
+            run_block((node,), self.namespace)
+    finally:
+        running.pop()
+
+
+def exec_block(self, namespace):
+    run_block(self.statements, namespace)
+
+
+def exec_conditional(self, namespace):
+    if evaluate(self.condition, namespace):
+        run_block(self.statements, namespace)
+    elif self.next_node is not None:
+        self.next_node.exec(namespace)
+
+
+def exec_while(self, namespace):
+    iteration = 0
+    while evaluate(self.condition, namespace):
+        iteration += 1
+        for callback in callbacks[LOOP]:
+            callback(self, namespace, iteration)
+        run_block(self.statements, namespace)
+
+
+def eval_call(self, namespace):
+    func = self.func_lookup.eval(namespace)
+    args = [evaluate(arg, namespace) for arg in self.arg_vals]
+    for callback in callbacks[CALL]:
+        callback(self, namespace, func, args)
+    try:
+        value = func(*args)
+    except ReturnValue as ret:
+        value = ret.val
+    for callback in callbacks[RETURN]:
+        callback(self, namespace, func, value)
+    return value
+
+
+def call(self, *arg_vals):
+    if len(arg_vals) != self.arity:
+        raise self.arity_error(len(arg_vals))
+    namespace = Namespace(parent=self.scope, obj_dict=dict(zip(self.args, arg_vals)))
+    for callback in callbacks[ENTER]:
+        callback(self, namespace)
+    running.append(self.name)
+    try:
+        run_block(self.statements, namespace)
+    finally:
+        running.pop()
+        for callback in callbacks[EXIT]:
+            callback(self, namespace)
+
+
+instrumented = {
+    (Module, "walk"): walk,
+    (ControlFlowElement, "exec"): exec_block,
+    (Conditional, "exec"): exec_conditional,
+    (While, "exec"): exec_while,
+    (Call, "eval"): eval_call,
+    (Func, "__call__"): call
+}
@@ -1,6 +1,9 @@
+import weakref
 from abc import ABC, abstractmethod
-from object import Func
-from namespace import Namespace
+from types import MethodType
+from object import Func, FrameFunc, FuncProfile, MemoFunc
+from namespace import Namespace, UNBOUND
+from tokens import operator_symbols
 
 
 class Module:
@@ -11,10 +14,15 @@ class Module:
         "print": print
     }
 
-    def __init__(self, nodes, name):
-        self.namespace = Namespace(obj_dict=Module.builtins)
+    def __init__(self, nodes, name, positions=None):
+        """
+        :param positions: tokens.Positions of the tokens the start and end of the nodes index (None if unknown)
+        """
+        self.namespace = Namespace(obj_dict=dict(Module.builtins))
         self.nodes = nodes
         self.name = name
+        self.positions = positions
+        self.compiled = {}
 
     def walk(self):
         for node in self.nodes:
@@ -25,9 +33,90 @@ class Module:
             else:
                 raise TypeError
 
+    def position(self, node):
+        """
+        :return: (line, column) of the first token of node, or None if unknown
+        """
+        if node.start is None or self.positions is None or node.start >= len(self.positions):
+            return None
+        return self.positions.position(node.start)
+
+    def error_position(self, error):
+        """
+        finds the innermost node whose exec or eval was running when error was raised, from the frames of its
+        traceback, so locating errors costs nothing until one is raised
+        only tree walked nodes leave such frames, so errors raised in compiled code are not located
+        :return: (line, column) of the node, or None if unknown
+        """
+        node = None
+        traceback = error.__traceback__
+        while traceback is not None:
+            frame_self = traceback.tb_frame.f_locals.get("self")
+            if isinstance(frame_self, AST_Node) and frame_self.start is not None:
+                node = frame_self
+            traceback = traceback.tb_next
+        return None if node is None else self.position(node)
+
+    def run_with(self, compiler):
+        """
+        compiles the module (once per compiler) and runs the result in the module's namespace
+        :param compiler: class whose compile_module(module) returns a function of form f(namespace)
+        """
+        if compiler not in self.compiled:
+            self.compiled[compiler] = compiler().compile_module(self)
+        try:
+            self.compiled[compiler](self.namespace)
+        finally:
+            # compiled code binds names by writing to obj_dict, so lookups cached while walking are stale
+            self.namespace.version += 1
+
+    def run_compiled(self):
+        """
+        runs the module through closures built by compiler.ClosureCompiler instead of walking the tree
+        """
+        from compiler import ClosureCompiler
+        self.run_with(ClosureCompiler)
+
+    def run_python(self):
+        """
+        runs the module as CPython bytecode produced by pycompiler.PythonCompiler
+        """
+        from pycompiler import PythonCompiler
+        self.run_with(PythonCompiler)
+
+    def run_resolved(self):
+        """
+        walks the module after resolver.Resolver has rewritten its names into frame slots
+        """
+        from resolver import Resolver
+        self.run_with(Resolver)
+
+    def run_bytecode(self):
+        """
+        runs the module on vm.VM after compiling it with bytecode.BytecodeCompiler
+        """
+        from bytecode import BytecodeCompiler
+        self.run_with(BytecodeCompiler)
+
 
 class AST_Node(ABC):
-    pass
+    # number of the source line the node starts on, set by the parser on every rule (None if unknown)
+    line = None
+    # indices in the module's token stream of the node's first token and of the token after its last, set by the
+    # parser on every node (None if unknown), which Module.position maps to a line and column
+    start = None
+    end = None
+
+    def locate(self, node):
+        """
+        gives self the source position of node, which it replaces
+        :return: self
+        """
+        if node.line is not None:
+            self.line = node.line
+        if node.start is not None:
+            self.start, self.end = node.start, node.end
+        return self
 
 
 class Statement(AST_Node):
@@ -41,6 +130,10 @@ class Expression(AST_Node):
     def eval(self, namespace):
         pass
 
+    def exec(self, namespace):
+        # expressions used as statements (e.g. calls inside a code block) discard their value
+        self.eval(namespace)
+
 
 class Assignment(Statement):
     def __init__(self, name, value):
@@ -52,15 +145,34 @@ class Assignment(Statement):
 
 
 class FuncDef(Statement):
-    def __init__(self, name, args, statements):
+    def __init__(self, name, args, statements, memo=None):
+        """
+        :param memo: True if calls go through a MemoFunc cache, False if they must not, None if undecided
+        """
         self.name = name
         self.args = args
         self.statements = statements
+        self.memo = memo
+        self.profile = FuncProfile(name, statements)
+        for loop in loops(statements):
+            loop.profile = self.profile
 
     def exec(self, namespace):
         func = Func(scope=namespace, name=self.name, args=self.args,
-                    statements=self.statements)
-        namespace.push(self.name, func)
+                    statements=self.statements, profile=self.profile)
+        namespace.push(self.name, MemoFunc(func) if self.memo else func)
+
+
+def loops(statements):
+    """
+    :yield: While nodes in statements and the blocks nested in them, except in nested function definitions
+    """
+    for node in statements:
+        while isinstance(node, ControlFlowElement):
+            if isinstance(node, While):
+                yield node
+            yield from loops(node.statements)
+            node = getattr(node, "next_node", None)
 
 
 class Output(Statement):
@@ -71,13 +183,37 @@ class Output(Statement):
         print(self.expression.eval(namespace))
 
 
-class Return(Statement, Exception):
+class Return(Statement):
     def __init__(self, expr):
         self.expr = expr
 
     def exec(self, namespace):
-        self.val = self.expr.eval(namespace)
-        raise self
+        # a new exception every time, as one raised again keeps the traceback, and so the frames and namespaces, of
+        # every time it was raised before
+        raise ReturnValue(self.expr.eval(namespace))
+
+
+class Unbind(Statement):
+    def __init__(self, names):
+        """
+        removes names bound in the namespace, e.g. temporaries the optimizer introduced
+        :param names: tuple of names, which must be bound
+        """
+        self.names = names
+
+    def exec(self, namespace):
+        for name in self.names:
+            del namespace.obj_dict[name]
+        # lookups cached through the namespace may have found the names in it
+        namespace.version += 1
+
+
+class ReturnValue(Exception):
+    def __init__(self, val):
+        """
+        raised by Return.exec to unwind a tree walked function to its call, which returns val
+        """
+        self.val = val
 
 
 class ControlFlowElement(Statement):
@@ -105,32 +241,74 @@ class Conditional(ControlFlowElement):
 class While(ControlFlowElement):
     def __init__(self, condition, statements):
         super().__init__(condition, statements)
+        # FuncProfile of the enclosing function, which counts the loop's iterations (None at module level)
+        self.profile = None
 
     def exec(self, namespace):
-        while self.condition.eval(namespace):
-            super().exec(namespace)
+        if self.profile is None:
+            while self.condition.eval(namespace):
+                super().exec(namespace)
+            return
+        iterations = 0
+        try:
+            while self.condition.eval(namespace):
+                super().exec(namespace)
+                iterations += 1
+        finally:
+            self.profile.loop_iterations += iterations
 
 
 class Call(Expression):
     def __init__(self, func_name, args):
         self.func_name = func_name
         self.arg_vals = args
+        # the call site's own lookup, whose inline cache holds the callee between calls
+        self.func_lookup = ObjectLookup(func_name)
 
     def eval(self, namespace):
-        func = ObjectLookup(self.func_name).eval(namespace)
+        func = self.func_lookup.eval(namespace)
         try:
-            func(*(arg.eval(namespace) for arg in self.arg_vals))
-            return ObjectLookup("null")
-        except Return as ret:
+            return func(*(arg.eval(namespace) for arg in self.arg_vals))
+        except ReturnValue as ret:
             return ret.val
 
 
 class ObjectLookup(Expression):
     def __init__(self, name):
         self.name = name
+        # inline cache: a weak reference to the parent of the namespace the name was last looked up from, and
+        # the versions of the namespaces from that parent up to the one the name was found in
+        # the parent chain of a namespace never changes, so the name is found in the same namespace for as long as
+        # no name was added to any of them since, and its value is read from that namespace on every lookup
+        self.scope = None
+        self.versions = None
 
     def eval(self, namespace):
-        return namespace.fetch(self.name)
+        name = self.name
+        obj_dict = namespace.obj_dict
+        if name in obj_dict:
+            return obj_dict[name]
+        parent = namespace.parent
+        if self.scope is not None and self.scope() is parent:
+            scope = parent
+            for version in self.versions:
+                if scope.version != version:
+                    break
+                found, scope = scope, scope.parent
+            else:
+                return found.obj_dict[name]
+        if parent is None:
+            raise LookupError
+        versions = []
+        scope = parent
+        while name not in scope.obj_dict:
+            versions.append(scope.version)
+            scope = scope.parent
+            if scope is None:
+                raise LookupError
+        versions.append(scope.version)
+        self.scope, self.versions = weakref.ref(parent), tuple(versions)
+        return scope.obj_dict[name]
 
 
 class Value(Expression):
@@ -151,10 +329,229 @@ class UnaryOperator(Expression):
 
 
 class BinaryOperator(Expression):
+    # number of evaluations seeing the same operand type after which a node is quickened
+    quicken_threshold = 8
+
     def __init__(self, func, left, right):
+        """
+        operator which observes the types of its operands, and once they have been the same type for
+        quicken_threshold evaluations, replaces its eval with a fast path for that type (see quickened_eval)
+        """
         self.func = func
         self.left = left
         self.right = right
+        # operand type seen so far and the number of evaluations which saw it
+        self.observed = None
+        self.count = 0
 
     def eval(self, namespace):
+        left = self.left.eval(namespace)
+        right = self.right.eval(namespace)
+        self.observe(type(left), type(right))
+        return self.func(left, right)
+
+    def observe(self, left_type, right_type):
+        if left_type is not right_type or self.observed not in (None, left_type):
+            # operand types vary, so the node stays generic
+            self.eval = self.generic_eval
+        elif self.observed is None:
+            self.observed, self.count = left_type, 1
+        else:
+            self.count += 1
+            if self.count >= self.quicken_threshold:
+                self.quicken()
+
+    def quicken(self):
+        symbol = operator_symbols.get(self.func)
+        if symbol not in quickenable.get(self.observed, ()):
+            self.eval = self.generic_eval
+        elif isinstance(self.right, Value):
+            self.constant = self.right.value
+            self.eval = MethodType(quickened_eval(symbol, self.observed, True), self)
+        else:
+            self.eval = MethodType(quickened_eval(symbol, self.observed, False), self)
+
+    def generic_eval(self, namespace):
         return self.func(self.left.eval(namespace), self.right.eval(namespace))
+
+    def deoptimize(self, left, right):
+        """
+        called by a quickened eval whose type guard failed, the node then stays generic
+        :return: result of the operation
+        """
+        self.eval = self.generic_eval
+        return self.func(left, right)
+
+
+# operators quickened into inline python operations for each operand type
+quickenable = {
+    int: ("+", "-", "*", "/", "**", "%", ">", "<", "==", "!=", ">=", "<=", ">>", "<<", "&", "|", "^"),
+    float: ("+", "-", "*", "/", "**", "%", ">", "<", "==", "!=", ">=", "<="),
+    str: ("+", ">", "<", "==", "!=", ">=", "<=")
+}
+quickened_templates = {
+    False: """
+def eval(self, namespace):
+    left = self.left.eval(namespace)
+    right = self.right.eval(namespace)
+    if type(left) is {type} and type(right) is {type}:
+        return left {symbol} right
+    return self.deoptimize(left, right)
+""",
+    # the right operand is a constant, so only the left one needs a guard
+    True: """
+def eval(self, namespace):
+    left = self.left.eval(namespace)
+    if type(left) is {type}:
+        return left {symbol} self.constant
+    return self.deoptimize(left, self.constant)
+"""
+}
+quickened = {}
+
+
+def quickened_eval(symbol, operand_type, constant):
+    """
+    builds (once) an eval for BinaryOperator computing the operation inline, guarded by operand type checks
+    coral's quickenable operators are spelled like python's, so the operation is written as is
+    :param constant: whether the right operand is a Value
+    :return: function of form f(node, namespace)
+    """
+    key = (symbol, operand_type, constant)
+    if key not in quickened:
+        scope = {}
+        exec(quickened_templates[constant].format(type=operand_type.__name__, symbol=symbol), scope)
+        quickened[key] = scope["eval"]
+    return quickened[key]
+
+
+class LogicalOperator(Expression):
+    def __init__(self, left, right):
+        """
+        short circuiting operator, whose right operand is only evaluated if the left one does not decide
+        the result
+        """
+        self.left = left
+        self.right = right
+
+
+class LogicalAnd(LogicalOperator):
+    def eval(self, namespace):
+        return self.left.eval(namespace) and self.right.eval(namespace)
+
+
+class LogicalOr(LogicalOperator):
+    def eval(self, namespace):
+        return self.left.eval(namespace) or self.right.eval(namespace)
+
+
+# constructor arguments of every node the parser and optimizer produce, in order, with the kind of each one
+node_fields = {
+    Assignment: (("name", "name"), ("value", "node")),
+    FuncDef: (("name", "name"), ("args", "names"), ("statements", "nodes"), ("memo", "constant")),
+    Output: (("expression", "node"),),
+    Return: (("expr", "node"),),
+    Conditional: (("condition", "node"), ("statements", "nodes"), ("next_node", "node")),
+    While: (("condition", "node"), ("statements", "nodes")),
+    Call: (("func_name", "name"), ("arg_vals", "nodes")),
+    ObjectLookup: (("name", "name"),),
+    Value: (("value", "constant"),),
+    BinaryOperator: (("func", "operator"), ("left", "node"), ("right", "node")),
+    LogicalAnd: (("left", "node"), ("right", "node")),
+    LogicalOr: (("left", "node"), ("right", "node")),
+    # only produced by the optimizer, last so the tags the parse cache gives the others do not change
+    Unbind: (("names", "names"),)
+}
+
+
+# nodes produced by resolver.Resolver, which run on namespace.Frame objects instead of Namespace objects
+class SlotLookup(Expression):
+    def __init__(self, name, depth, slot):
+        self.name = name
+        self.depth = depth
+        self.slot = slot
+
+    def eval(self, frame):
+        value = frame.display[self.depth][self.slot]
+        if value is UNBOUND:
+            raise LookupError
+        return value
+
+
+class LocalLookup(SlotLookup):
+    def eval(self, frame):
+        value = frame.slots[self.slot]
+        if value is UNBOUND:
+            raise LookupError
+        return value
+
+
+class FallbackLookup(Expression):
+    def __init__(self, name, addresses):
+        """
+        lookup of a name which may still be unbound in the innermost scopes that bind it
+        :param addresses: tuple of (depth, slot) pairs tried in order
+        """
+        self.name = name
+        self.addresses = addresses
+
+    def eval(self, frame):
+        display = frame.display
+        for depth, slot in self.addresses:
+            value = display[depth][slot]
+            if value is not UNBOUND:
+                return value
+        raise LookupError
+
+
+class SlotAssignment(Statement):
+    def __init__(self, name, slot, value):
+        self.name = name
+        self.slot = slot
+        self.value = value
+
+    def exec(self, frame):
+        frame.slots[self.slot] = self.value.eval(frame)
+
+
+class SlotFuncDef(Statement):
+    def __init__(self, name, slot, args, statements, size, memo=None):
+        """
+        :param size: number of slots in the function's frame
+        """
+        self.name = name
+        self.slot = slot
+        self.args = args
+        self.statements = statements
+        self.size = size
+        self.memo = memo
+
+    def exec(self, frame):
+        func = FrameFunc(scope=frame, name=self.name, args=self.args, statements=self.statements, size=self.size)
+        frame.slots[self.slot] = MemoFunc(func) if self.memo else func
+
+
+class SlotUnbind(Statement):
+    def __init__(self, names, slots):
+        self.names = names
+        self.slots = slots
+
+    def exec(self, frame):
+        for slot in self.slots:
+            frame.slots[slot] = UNBOUND
+
+
+class SlotCall(Expression):
+    def __init__(self, func, args):
+        """
+        :param func: SlotLookup or FallbackLookup resolving the called function
+        """
+        self.func = func
+        self.arg_vals = args
+
+    def eval(self, frame):
+        func = self.func.eval(frame)
+        try:
+            return func(*[arg.eval(frame) for arg in self.arg_vals])
+        except ReturnValue as ret:
+            return ret.val
@@ -0,0 +1,241 @@
+from collections import Counter
+from bytecode import *
+from namespace import Namespace
+from object import BytecodeFunc, MemoFunc
+
+
+class VM:
+    def __init__(self, max_depth=1000000):
+        """
+        stack machine executing bytecode.CodeObjects, as decoded by bytecode.specialize
+        calls between coral functions run on an explicit call stack instead of recursing in python, so coral
+        recursion is not bound by python's recursion limit
+        :param max_depth: maximum number of suspended coral calls
+        """
+        self.max_depth = max_depth
+
+    def instructions(self, code_object):
+        """
+        :return: the instructions the vm runs for code_object, decoded once and kept on it
+        """
+        if code_object.instructions is None:
+            code_object.instructions = specialize(code_object)
+        return code_object.instructions
+
+    def execute(self, code_object, namespace):
+        """
+        runs a code object until it returns
+        :param code_object: CodeObject to run
+        :param namespace: Namespace the code's names are loaded from and stored in
+        :return: the returned value
+        """
+        instructions = self.instructions
+        max_depth = self.max_depth
+        code = instructions(code_object)
+        obj_dict = namespace.obj_dict
+        nonlocals = Nonlocals(namespace.parent)
+        # names missing from the namespace are mostly found in its parent, e.g. functions a function calls
+        parent_dict = {} if namespace.parent is None else namespace.parent.obj_dict
+        stack = []
+        push, pop = stack.append, stack.pop
+        pc = 0
+        # (code, namespace, parent_dict, nonlocals, stack, pc) of every suspended caller
+        frames = []
+        # instructions are told apart in two steps, those emitted by the compiler from the superinstructions,
+        # so that none is more than a few comparisons away; branches are ordered by how often they run
+        while True:
+            op, arg = code[pc]
+            pc += 1
+            if op < BINARY_CONST:
+                if op == LOAD_NAME:
+                    if arg in obj_dict:
+                        push(obj_dict[arg])
+                    elif arg in parent_dict:
+                        push(parent_dict[arg])
+                    else:
+                        push(nonlocals[arg])
+                elif op == BINARY_OP:
+                    right = pop()
+                    stack[-1] = arg(stack[-1], right)
+                elif op == STORE_NAME:
+                    obj_dict[arg] = pop()
+                elif op == CALL or op == TAIL_CALL:
+                    func = stack[-arg - 1]
+                    if type(func) is BytecodeFunc:
+                        if arg != func.arity:
+                            raise func.arity_error(arg)
+                        # the arguments are bound straight from the stack, the usual arities without a zip
+                        names = func.args
+                        if arg == 1:
+                            local_dict = {names[0]: pop()}
+                        elif arg == 2:
+                            second = pop()
+                            local_dict = {names[0]: pop(), names[1]: second}
+                        elif arg:
+                            local_dict = dict(zip(names, stack[-arg:]))
+                            del stack[-arg:]
+                        else:
+                            local_dict = {}
+                        pop()
+                        # a tail call abandons the current frame instead of suspending it
+                        if op == CALL:
+                            if len(frames) >= max_depth:
+                                raise RecursionError("maximum coral call depth exceeded")
+                            frames.append((code, namespace, parent_dict, nonlocals, stack, pc))
+                        code = func.instructions
+                        namespace = Namespace(func.scope, local_dict)
+                        obj_dict = local_dict
+                        parent_dict = func.scope.obj_dict
+                        nonlocals = Nonlocals(func.scope)
+                        stack = []
+                        push, pop = stack.append, stack.pop
+                        pc = 0
+                    else:
+                        if arg:
+                            args = stack[-arg:]
+                            del stack[-arg:]
+                        else:
+                            args = ()
+                        pop()
+                        # TAIL_CALL is followed by RETURN_VALUE, which returns the result of calling a builtin
+                        push(func(*args))
+                elif op == RETURN_VALUE:
+                    value = pop()
+                    if not frames:
+                        return value
+                    code, namespace, parent_dict, nonlocals, stack, pc = frames.pop()
+                    obj_dict = namespace.obj_dict
+                    push, pop = stack.append, stack.pop
+                    push(value)
+                elif op == LOAD_CONST:
+                    push(arg)
+                elif op == JUMP:
+                    pc = arg
+                elif op == POP_JUMP_IF_FALSE:
+                    if not pop():
+                        pc = arg
+                elif op == POP_TOP:
+                    pop()
+                elif op == JUMP_IF_FALSE_OR_POP:
+                    if stack[-1]:
+                        pop()
+                    else:
+                        pc = arg
+                elif op == JUMP_IF_TRUE_OR_POP:
+                    if stack[-1]:
+                        pc = arg
+                    else:
+                        pop()
+                elif op == MAKE_FUNCTION:
+                    func = BytecodeFunc(scope=namespace, code=arg, vm=self)
+                    # calls from the vm run the instructions directly instead of going through the function
+                    func.instructions = instructions(arg)
+                    push(MemoFunc(func) if func.code.memo else func)
+                elif op == PRINT:
+                    print(pop())
+                elif op == DELETE_NAME:
+                    del obj_dict[arg]
+                else:
+                    raise SystemError("unknown opcode {}".format(op))
+            elif op == BINARY_NAME_CONST:
+                name, right, func = arg
+                push(func(obj_dict[name] if name in obj_dict else nonlocals[name], right))
+                pc += 2
+            elif op == COPY_NAME:
+                name, target = arg
+                obj_dict[target] = obj_dict[name] if name in obj_dict else nonlocals[name]
+                pc += 1
+            elif op == JUMP_UNLESS_NAME_CONST:
+                name, right, func, target, pc = arg
+                if not func(obj_dict[name] if name in obj_dict else nonlocals[name], right):
+                    pc = target
+            elif op == STORE_BINARY_NAME_NAME:
+                left, right, func, target = arg
+                obj_dict[target] = func(obj_dict[left] if left in obj_dict else nonlocals[left],
+                                        obj_dict[right] if right in obj_dict else nonlocals[right])
+                pc += 3
+            elif op == STORE_BINARY_NAME_CONST:
+                name, right, func, target = arg
+                obj_dict[target] = func(obj_dict[name] if name in obj_dict else nonlocals[name], right)
+                pc += 3
+            elif op == JUMP_UNLESS_NAME:
+                name, target, pc = arg
+                if not (obj_dict[name] if name in obj_dict else nonlocals[name]):
+                    pc = target
+            elif op == BINARY_NAME:
+                name, func = arg
+                stack[-1] = func(stack[-1], obj_dict[name] if name in obj_dict else nonlocals[name])
+                pc += 1
+            elif op == BINARY_NAME_NAME:
+                left, right, func = arg
+                push(func(obj_dict[left] if left in obj_dict else nonlocals[left],
+                          obj_dict[right] if right in obj_dict else nonlocals[right]))
+                pc += 2
+            elif op == BINARY_CONST:
+                right, func = arg
+                stack[-1] = func(stack[-1], right)
+                pc += 1
+            elif op == JUMP_UNLESS_NAME_NAME:
+                left, right, func, target, pc = arg
+                if not func(obj_dict[left] if left in obj_dict else nonlocals[left],
+                            obj_dict[right] if right in obj_dict else nonlocals[right]):
+                    pc = target
+            elif op == STORE_CONST:
+                value, target = arg
+                obj_dict[target] = value
+                pc += 1
+            else:
+                raise SystemError("unknown opcode {}".format(op))
+
+
+class Nonlocals(dict):
+    __slots__ = ("parent",)
+
+    def __init__(self, parent):
+        """
+        values of the names a frame has loaded from the namespaces enclosing its own, looked up once per frame
+        only the frame running in a namespace stores to it, and the frames of enclosing namespaces are suspended
+        or have returned while it runs, so the values cannot change under it
+        :param parent: parent of the frame's namespace
+        """
+        self.parent = parent
+
+    def __missing__(self, name):
+        namespace = self.parent
+        while namespace is not None:
+            if name in namespace.obj_dict:
+                value = self[name] = namespace.obj_dict[name]
+                return value
+            namespace = namespace.parent
+        raise LookupError
+
+
+class CountedInstructions(list):
+    def __init__(self, instructions, counts):
+        """
+        instructions which tally the opcode of every instruction fetched from them in counts
+        """
+        super().__init__(instructions)
+        self.counts = counts
+
+    def __getitem__(self, i):
+        instruction = super().__getitem__(i)
+        self.counts[instruction[0]] += 1
+        return instruction
+
+
+class CountingVM(VM):
+    def __init__(self, max_depth=1000000):
+        """
+        vm which tallies executed instructions by opcode in self.counts
+        instructions are counted as they are fetched, so the plain VM's loop pays nothing for counting, and
+        superinstructions are not fused, so the counts are of the compiled instructions
+        """
+        super().__init__(max_depth)
+        self.counts = Counter()
+        self.decoded = {}
+
+    def instructions(self, code_object):
+        if code_object not in self.decoded:
+            self.decoded[code_object] = CountedInstructions(specialize(code_object, fuse=False), self.counts)
+        return self.decoded[code_object]